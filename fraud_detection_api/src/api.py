@@ -1,17 +1,153 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Query
 from fraud_detection_common.database import Database
-from fraud_detection_common.embeddings import EmbeddingGenerator
-from fraud_detection_common.config_schema import ModelConfig
-from typing import List, Optional
+from fraud_detection_common.model_artifact import ModelArtifact
+from fraud_detection_common.embedding_cache import GroupEmbeddingCache
+from fraud_detection_common.config_snapshot import ConfigSnapshot, ConfigStore
+from fraud_detection_common.result_cache import ResultCache
+from fraud_detection_common.match_keys import MatchKeys
+from fraud_detection_common.case_filter import CaseFilter
+from fraud_detection_common.sharding import ShardedCaseStore
+from fraud_detection_api.batching import EvaluationBatcher
+from fraud_detection_api.admin import require_admin_token
+from typing import Dict, List, Optional, Tuple
 from pydantic import BaseModel
+from datetime import datetime, timedelta, timezone
+import asyncio
+import logging
+import os
 
-# Load configuration
-with open("config/model_config.json") as f:
-    config = ModelConfig.parse_raw(f.read())
+logger = logging.getLogger(__name__)
+
+# Load configuration once; requests read thresholds and field rules from config_store.current
+config_store = ConfigStore(
+    os.getenv("FRAUD_DETECTION_DB_CONFIG", "config/database_config.json"),
+    "config/model_config.json"
+)
+config = config_store.current.model  # Bound at startup: table name, caches, batching
+db_config = config_store.current.database
 
 # Initialize components
-db = Database(config)
-embedding_generator = EmbeddingGenerator(config)
+db = Database(
+    config,
+    db_config,
+    vector_index=next(iter(db_config.tables.values())).vector_index(),
+    group_vectors=db_config.group_vectors,
+    compaction=db_config.compaction
+)
+# Searches scatter across the shards when the case table is sharded
+case_store = ShardedCaseStore.from_config(db_config) if db_config.sharding is not None else None
+match_keys = MatchKeys.from_model_config(config)
+result_cache = None
+if db_config.result_cache.enabled:
+    result_cache = ResultCache(
+        max_entries=db_config.result_cache.max_entries,
+        ttl_seconds=db_config.result_cache.ttl_seconds
+    )
+group_cache = GroupEmbeddingCache(config.embedding_cache.max_entries) if config.embedding_cache.enabled else None
+model_artifact = ModelArtifact.load(
+    os.getenv("FRAUD_DETECTION_MODEL_ARTIFACT", "config/embedding_model.pkl"),
+    group_cache=group_cache
+)
+embedding_generator = model_artifact.generator
+
+# Coalesce concurrent /evaluate requests when batching is enabled in the config
+batcher = None
+if config.batching.enabled:
+    batcher = EvaluationBatcher(
+        embedding_generator,
+        db,
+        threshold=config.similarity_thresholds["review"],
+        max_wait_ms=config.batching.max_wait_ms,
+        max_batch_size=config.batching.max_batch_size
+    )
+    config_store.subscribe(
+        lambda snapshot: setattr(batcher, "threshold", snapshot.model.similarity_thresholds["review"])
+    )
+
+def _use_artifact(artifact: ModelArtifact):
+    """Serve a new model artifact from now on"""
+    global model_artifact, embedding_generator
+    model_artifact = artifact
+    embedding_generator = artifact.generator
+    if batcher is not None:
+        batcher.embedding_generator = artifact.generator
+
+class ReembedFollower:
+    """Follows a re-embedding migration of the case table in this worker
+
+    While a migration runs, its model artifact is loaded next to the current one
+    so searches cover both embedding versions; once it has cut over, the worker
+    switches to that artifact. A background task re-reads the state every
+    poll_seconds and loads artifacts in a worker thread, then swaps them in on
+    the event loop, so requests never wait on either.
+    """
+
+    def __init__(self, poll_seconds: float = 1.0):
+        self.poll_seconds = poll_seconds
+        self.state: Optional[dict] = None
+        self.next_artifact: Optional[ModelArtifact] = None  # Set only while a migration runs
+        self.next_path: Optional[str] = None
+        self.applied_at: Optional[datetime] = None  # completed_at of the migration being served
+        self._stopping: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Serve the artifact of the last completed migration and start following the next one
+
+        The artifact loaded at startup is only kept if it is the one the migration
+        cut over to; otherwise, e.g. when it was not installed after the cutover,
+        the migration's artifact is loaded instead.
+        """
+        self.state = db.get_reembed_state()
+        if self.state is not None and self.state['status'] == 'complete':
+            if ModelArtifact.checksum(model_artifact.path) != ModelArtifact.checksum(self.state['artifact_path']):
+                logger.warning(
+                    f"{model_artifact.path} is not the artifact the case table was re-embedded with; "
+                    f"serving {self.state['artifact_path']}"
+                )
+                _use_artifact(ModelArtifact.load(self.state['artifact_path'], group_cache=group_cache))
+            self.applied_at = self.state['completed_at']
+        self._stopping = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def _poll(self) -> Tuple[Optional[dict], Optional[ModelArtifact], Optional[ModelArtifact]]:
+        """Read the state and load the artifact it calls for; return the state, next artifact and cut-over artifact"""
+        state = db.get_reembed_state()
+        if state is not None and state['status'] == 'running':
+            if self.next_artifact is not None and self.next_path == state['artifact_path']:
+                return state, self.next_artifact, None
+            return state, ModelArtifact.load(state['artifact_path']), None
+        if state is not None and state['status'] == 'complete' and state['completed_at'] != self.applied_at:
+            return state, None, ModelArtifact.load(state['artifact_path'], group_cache=group_cache)
+        return state, None, None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while not self._stopping.is_set():
+            try:
+                state, next_artifact, cut_over = await loop.run_in_executor(None, self._poll)
+                # Swapped in together between requests
+                if cut_over is not None:
+                    _use_artifact(cut_over)
+                    self.applied_at = state['completed_at']
+                self.state = state
+                self.next_artifact = next_artifact
+                self.next_path = state['artifact_path'] if next_artifact is not None else None
+            except Exception:
+                logger.exception("Reading the re-embedding state failed, will retry")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def close(self):
+        """Stop the background task"""
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+
+reembed_follower = ReembedFollower()
 
 # Create response models dynamically
 class FieldMatch(BaseModel):
@@ -30,16 +166,29 @@ class EvaluationResponse(BaseModel):
     decision: str
     vector_similarity: float
     field_matches: List[FraudCase]
+    partial_results: bool = False  # Set when some shards did not answer
+    failed_shards: List[str] = []
 
 app = FastAPI(title="Fraud Detection API")
+app.state.ready = False
 
-def _compare_fields(new_app: dict, fraud_app: dict) -> List[FieldMatch]:
-    """Compare fields between applications"""
+def _compare_fields(new_app: dict, fraud_app: dict, new_keys: Dict[str, Optional[str]],
+                    snapshot: ConfigSnapshot) -> List[FieldMatch]:
+    """Compare fields between applications
+
+    Fields with a match key compare the new application's keys, computed once per
+    request, with the keys Postgres stored for the fraud case.
+    """
     matches = []
     
-    for field in config.fields:
+    for field in snapshot.model.fields:
         if field.name in new_app and field.name in fraud_app:
-            if str(new_app[field.name]).lower() == str(fraud_app[field.name]).lower():
+            key_column = match_keys.column(field.name)
+            if field.name in new_keys and key_column in fraud_app:
+                matched = new_keys[field.name] is not None and new_keys[field.name] == fraud_app[key_column]
+            else:
+                matched = str(new_app[field.name]).lower() == str(fraud_app[field.name]).lower()
+            if matched:
                 matches.append(FieldMatch(
                     field=field.name,
                     new_value=str(new_app[field.name]),
@@ -49,66 +198,268 @@ def _compare_fields(new_app: dict, fraud_app: dict) -> List[FieldMatch]:
     
     return matches
 
-@app.post("/evaluate", response_model=EvaluationResponse)
-async def evaluate_application(application: dict):
-    """Evaluate a merchant application for potential fraud"""
-    try:
+async def _evaluate(application: dict, snapshot: ConfigSnapshot, case_filter: Optional[CaseFilter] = None,
+                    group_weights: Optional[Dict[str, float]] = None,
+                    include_archive: bool = False) -> EvaluationResponse:
+    """Run the similarity search and field comparison for an application"""
+    thresholds = snapshot.model.similarity_thresholds
+    next_artifact = reembed_follower.next_artifact
+    if case_store is not None:
+        # Each shard's top-k is merged into the global top-k
+        if db.group_vectors is not None:
+            group_embeddings = {
+                group: vectors[0]
+                for group, vectors in embedding_generator.transform_groups_batch([application]).items()
+            }
+            similar_cases = case_store.find_similar_cases_by_group(
+                group_embeddings,
+                group_weights,
+                threshold=thresholds["review"],
+                case_filter=case_filter
+            )
+        else:
+            similar_cases = case_store.find_similar_cases(
+                embedding_generator.transform(application),
+                threshold=thresholds["review"],
+                case_filter=case_filter,
+                include_archive=include_archive
+            )
+    elif db.group_vectors is not None:
+        # Per-group vectors are combined with this request's weights
+        group_embeddings = {
+            group: vectors[0]
+            for group, vectors in embedding_generator.transform_groups_batch([application]).items()
+        }
+        similar_cases = db.find_similar_cases_by_group(
+            group_embeddings,
+            group_weights,
+            threshold=thresholds["review"],
+            case_filter=case_filter
+        )
+    elif next_artifact is not None and case_filter is None and not include_archive:
+        # Search both embedding versions until the migration cuts over
+        similar_cases, _ = db.find_similar_cases_reembedding(
+            embedding_generator.transform(application),
+            next_artifact.generator.transform(application),
+            threshold=thresholds["review"]
+        )
+    elif db.compaction is not None and case_filter is None and not include_archive:
+        # At most one case per near-duplicate cluster until the results run short
+        similar_cases = db.find_similar_cases_compacted(
+            embedding_generator.transform(application),
+            threshold=thresholds["review"]
+        )
+    elif batcher is not None and case_filter is None and not include_archive:
+        # Embedding and similarity search are shared with concurrent requests
+        similar_cases = await batcher.submit(application)
+    else:
         # Generate embedding
-        embedding = embedding_generator.generate_embedding(application)
+        embedding = embedding_generator.transform(application)
         
         # Find similar cases
         similar_cases = db.find_similar_cases(
             embedding,
-            threshold=config.similarity_thresholds["review"]
+            threshold=thresholds["review"],
+            case_filter=case_filter,
+            include_archive=include_archive
         )
+    
+    failed_shards = getattr(similar_cases, "failed_shards", [])
+    if not similar_cases:
+        return EvaluationResponse(
+            decision="Approve",
+            vector_similarity=0.0,
+            field_matches=[],
+            partial_results=bool(failed_shards),
+            failed_shards=failed_shards
+        )
+    
+    # Process matches
+    field_matches = []
+    application_keys = match_keys.keys(application)
+    for case in similar_cases:
+        merchant_id, similarity, fraud_app, fraud_reason = case
+        matches = _compare_fields(application, fraud_app, application_keys, snapshot)
         
-        if not similar_cases:
-            return EvaluationResponse(
-                decision="Approve",
-                vector_similarity=0.0,
-                field_matches=[]
-            )
-        
-        # Process matches
-        field_matches = []
-        for case in similar_cases:
-            merchant_id, similarity, fraud_app, fraud_reason = case
-            matches = _compare_fields(application, fraud_app)
-            
-            if matches:
-                field_matches.append(FraudCase(
-                    merchant_id=merchant_id,
-                    vector_similarity=similarity,
-                    fraud_reason=fraud_reason,
-                    matching_fields=matches
-                ))
-        
-        if not field_matches:
-            return EvaluationResponse(
-                decision="Approve",
-                vector_similarity=0.0,
-                field_matches=[]
-            )
-        
-        # Make decision based on best match
-        best_match = field_matches[0]
-        if best_match.vector_similarity > config.similarity_thresholds["decline"]:
-            decision = "Decline"
-        elif best_match.vector_similarity > config.similarity_thresholds["review"]:
-            decision = "Review"
-        else:
-            decision = "Approve"
-        
+        if matches:
+            field_matches.append(FraudCase(
+                merchant_id=merchant_id,
+                vector_similarity=similarity,
+                fraud_reason=fraud_reason,
+                matching_fields=matches
+            ))
+    
+    if not field_matches:
         return EvaluationResponse(
-            decision=decision,
-            vector_similarity=best_match.vector_similarity,
-            field_matches=field_matches
+            decision="Approve",
+            vector_similarity=0.0,
+            field_matches=[],
+            partial_results=bool(failed_shards),
+            failed_shards=failed_shards
         )
+    
+    # Make decision based on best match
+    best_match = field_matches[0]
+    if best_match.vector_similarity > thresholds["decline"]:
+        decision = "Decline"
+    elif best_match.vector_similarity > thresholds["review"]:
+        decision = "Review"
+    else:
+        decision = "Approve"
+    
+    return EvaluationResponse(
+        decision=decision,
+        vector_similarity=best_match.vector_similarity,
+        field_matches=field_matches,
+        partial_results=bool(failed_shards),
+        failed_shards=failed_shards
+    )
+
+@app.post("/evaluate", response_model=EvaluationResponse)
+async def evaluate_application(
+    application: dict,
+    same: List[str] = Query(default=[], description="Only compare with cases sharing these field values, e.g. same=country&same=state"),
+    created_within_days: Optional[int] = Query(default=None, gt=0, description="Only compare with cases from the last N days"),
+    weight: List[str] = Query(default=[], description="Feature-group weight overrides, e.g. weight=identity:2&weight=location:0"),
+    include_archive: bool = Query(default=False, description="Also compare with archived cases")
+):
+    """Evaluate a merchant application for potential fraud"""
+    snapshot = config_store.current
+    # Malformed applications are rejected before any embedding or database work
+    errors = snapshot.validator.validate(application)
+    if errors:
+        raise HTTPException(status_code=400, detail=errors)
+    
+    field_names = {field.name for field in snapshot.model.fields}
+    unknown = [name for name in same if name not in field_names or name not in application]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Cannot filter on fields missing from the application: {unknown}")
+    
+    group_weights = None
+    if db.group_vectors is not None:
+        group_weights = {
+            group.name: group.weight
+            for group in snapshot.model.feature_groups if group.name in db.group_vectors.groups
+        }
+        for override in weight:
+            group, _, value = override.partition(":")
+            if group not in group_weights:
+                raise HTTPException(status_code=400, detail=f"No per-group vectors stored for feature group {group}")
+            try:
+                group_weights[group] = float(value)
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Invalid weight {override!r}, expected group:number")
+    elif weight:
+        raise HTTPException(status_code=400, detail="Weight overrides need group_vectors in the database config")
+    
+    if include_archive and (db_config.retention is None or db.group_vectors is not None):
+        raise HTTPException(status_code=400, detail="Archive search needs retention and no group_vectors in the database config")
+    
+    case_filter = None
+    if same or created_within_days is not None:
+        case_filter = CaseFilter(
+            fields={name: str(application[name]) for name in same},
+            created_after=(
+                datetime.now(timezone.utc) - timedelta(days=created_within_days)
+                if created_within_days is not None else None
+            )
+        )
+    
+    try:
+        if result_cache is None:
+            return await _evaluate(application, snapshot, case_filter, group_weights, include_archive)
+        
+        # Serve identical resubmissions from the cache while the case table is unchanged
+        cache_key = ResultCache.key("evaluate", {
+            "application": application,
+            "same": sorted(same),
+            "created_within_days": created_within_days,
+            "group_weights": group_weights,
+            "include_archive": include_archive
+        })
+        # A config reload also invalidates, since responses depend on the thresholds
+        case_generation = (case_store or db).get_case_generation()
+        generation = (snapshot.version, case_generation) if case_generation is not None else None
+        response = result_cache.get(cache_key, generation)
+        if response is None:
+            response = await _evaluate(application, snapshot, case_filter, group_weights, include_archive)
+            # Results missing unanswered shards are not cached
+            if generation is not None and not response.partial_results:
+                result_cache.put(cache_key, generation, response)
+        return response
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/stats/embedding-cache")
+async def embedding_cache_stats():
+    """Hit/miss statistics of the per-feature-group embedding cache"""
+    if group_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **group_cache.stats()}
+
+@app.post("/admin/reload-config", dependencies=[Depends(require_admin_token)])
+async def reload_config():
+    """Reload the config files now; the current config stays in place if the new one is invalid"""
+    try:
+        snapshot = config_store.reload()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Config not reloaded: {e}")
+    return {"version": snapshot.version, "loaded_at": snapshot.loaded_at.isoformat()}
+
+@app.get("/stats/result-cache")
+async def result_cache_stats():
+    """Hit/miss statistics of the evaluation result cache"""
+    if result_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **result_cache.stats()}
+
+@app.get("/stats/reembed")
+async def reembed_stats():
+    """Status, progress and throughput of the case table's re-embedding migration"""
+    state = db.get_reembed_state()
+    if state is None:
+        return {"status": None}
+    return state
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 503 until this worker has finished its startup checks"""
+    if not app.state.ready:
+        raise HTTPException(status_code=503, detail="Not ready")
+    return {"ready": True, "pid": os.getpid()}
+
+@app.on_event("startup")
+async def startup_event():
+    """Refuse to serve if the stored vectors and the model artifact disagree on dimension"""
+    app.state.ready = False
+    # Everything above may have been loaded before a preloading server forked; connections
+    # inherited from it must not be shared, so this worker opens its own
+    db.engine.dispose(close=False)
+    if case_store is not None:
+        for shard in case_store.shards:
+            shard.model_generator.engine.dispose(close=False)
+    reembed_follower.start()
+    stored_dims = {"": db.get_embedding_dim()} if case_store is None else {
+        f" on {shard.name}": shard.get_embedding_dim() for shard in case_store.shards
+    }
+    for location, stored_dim in stored_dims.items():
+        if stored_dim != model_artifact.embedding_dim:
+            raise RuntimeError(
+                f"Embedding column of {config.name}{location} has dimension {stored_dim} but the model artifact "
+                f"produces {model_artifact.embedding_dim}; retrain or rebuild the table"
+            )
+    if db_config.config_reload.watch:
+        config_store.watch(db_config.config_reload.interval_seconds)
+    app.state.ready = True
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """Clean up resources on shutdown"""
+    config_store.close()
+    await reembed_follower.close()
+    if batcher is not None:
+        await batcher.close()
+    if case_store is not None:
+        case_store.close()
     db.close() 
\ No newline at end of file
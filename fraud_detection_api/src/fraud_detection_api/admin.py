@@ -0,0 +1,19 @@
+import hmac
+import os
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+
+def get_admin_token() -> Optional[str]:
+    """Get the token admin endpoints require; they are disabled when it is not set"""
+    return os.getenv("FRAUD_DETECTION_ADMIN_TOKEN") or None
+
+
+def require_admin_token(x_admin_token: Optional[str] = Header(default=None)):
+    """Dependency that rejects requests without the admin token in the X-Admin-Token header"""
+    admin_token = get_admin_token()
+    if admin_token is None:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled; set FRAUD_DETECTION_ADMIN_TOKEN")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode(), admin_token.encode()):
+        raise HTTPException(status_code=401, detail="Missing or invalid admin token")
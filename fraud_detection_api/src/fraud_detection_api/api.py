@@ -1,59 +1,129 @@
-from fastapi import FastAPI, HTTPException, Depends
-from pydantic import BaseModel, create_model
-from typing import Optional, Dict, Any, List
-from fraud_detection_common.database import Database
-from fraud_detection_common.config import load_config
+from fastapi import FastAPI, HTTPException, Depends, Request
+from pydantic import BaseModel
+from typing import Optional, Dict, Any
+from fraud_detection_common.config_snapshot import ConfigSnapshot, ConfigStore
 from fraud_detection_common.dynamic_model import DynamicModelGenerator
+from fraud_detection_common.sharding import ShardedCaseStore
+from fraud_detection_common.result_cache import ResultCache
+from fraud_detection_common.identity_links import IdentityLinkGraph
+from fraud_detection_common.match_keys import MatchKeys
+from fraud_detection_api.write_behind import WriteBehindQueue
+from fraud_detection_api.admin import require_admin_token
+from contextlib import asynccontextmanager
+from sqlalchemy import text
+import logging
 import uvicorn
 import os
+from pathlib import Path
 from collections import defaultdict
 
-app = FastAPI(title="Fraud Detection API")
+def get_config_path() -> str:
+    """Get the database config path"""
+    return os.getenv("FRAUD_DETECTION_CONFIG", "/app/config/database_config.json")
 
-def get_model_generator():
-    """Dependency to get the model generator"""
-    config_path = os.getenv("FRAUD_DETECTION_CONFIG", "/app/config/database_config.json")
-    model_generator = DynamicModelGenerator(config_path)
+def get_model_config_path() -> str:
+    """Get the model config path, whose feature-group preprocessing defines the match keys"""
+    return os.getenv("FRAUD_DETECTION_MODEL_CONFIG", "/app/config/model_config.json")
+
+logger = logging.getLogger(__name__)
+
+def load_config_store() -> ConfigStore:
+    """Load and compile the database and model config files"""
+    model_config_path = get_model_config_path() if Path(get_model_config_path()).exists() else None
+    return ConfigStore(get_config_path(), model_config_path)
+
+def preload(app: FastAPI):
+    """Load the config in the server process before it forks its workers
+
+    Workers inherit the compiled config instead of each loading it. Connections
+    and threads are still created per worker, in the lifespan.
+    """
+    app.state.config_store = load_config_store()
+
+def warm_up(app: FastAPI) -> bool:
+    """Open a pooled database connection; the app reports ready once this succeeds"""
+    try:
+        with app.state.model_generator.engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except Exception:
+        logger.exception("Warm-up failed, not ready yet")
+        return False
+    app.state.ready = True
+    return True
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Load the config and set up the database, case store, caches and queues once; flush on shutdown"""
+    app.state.ready = False
+    config_store = getattr(app.state, "config_store", None) or load_config_store()
+    snapshot = config_store.current
+    app.state.config_store = config_store
+    app.state.case_store = None
+    app.state.result_cache = None
+    app.state.identity_links = None
+    app.state.match_keys = None
+    app.state.write_behind = None
+    
+    # Connection, table and store settings are bound here; a config reload does not change them
+    model_generator = DynamicModelGenerator(db_config=snapshot.database)
+    app.state.model_generator = model_generator
+    app.state.case_model = model_generator.get_sqlalchemy_model()
+    if snapshot.model is not None:
+        # Must match the key columns generated at training time
+        app.state.match_keys = MatchKeys.from_model_config(snapshot.model)
+    if snapshot.database.sharding is not None:
+        app.state.case_store = ShardedCaseStore.from_config(snapshot.database)
+    if snapshot.database.result_cache.enabled:
+        app.state.result_cache = ResultCache(
+            max_entries=snapshot.database.result_cache.max_entries,
+            ttl_seconds=snapshot.database.result_cache.ttl_seconds
+        )
+    if snapshot.database.identity_links is not None:
+        # Kept in the primary database, also when the case table is sharded
+        app.state.identity_links = IdentityLinkGraph(
+            model_generator, snapshot.database.identity_links, app.state.match_keys
+        )
+    settings = snapshot.database.write_behind
+    if settings.enabled:
+        app.state.write_behind = WriteBehindQueue(
+            settings.queue_path,
+            model_generator,
+            batch_size=settings.batch_size,
+            drain_interval_ms=settings.drain_interval_ms,
+            synchronous=settings.synchronous,
+            case_store=app.state.case_store,
+            identity_links=app.state.identity_links
+        )
+        app.state.write_behind.start()
+    if snapshot.database.config_reload.watch:
+        config_store.watch(snapshot.database.config_reload.interval_seconds)
+    warm_up(app)
     try:
-        yield model_generator
+        yield
     finally:
+        config_store.close()
+        if app.state.write_behind is not None:
+            await app.state.write_behind.close()
+        if app.state.case_store is not None:
+            app.state.case_store.close()
         model_generator.close()
 
-def get_merchant_model(model_generator: DynamicModelGenerator = Depends(get_model_generator)):
-    """Dependency to get the merchant model"""
-    table_config = next(iter(model_generator.db_config.tables.values()))
-    fields = {field['name']: (str, ...) for field in table_config.fields}
-    # Add merchant_id to the fields
-    fields['merchant_id'] = (str, ...)
-    return create_model('MerchantApplication', **fields)
-
-def get_table_fields(model_generator: DynamicModelGenerator = Depends(get_model_generator)):
-    """Dependency to get the table fields"""
-    table_config = next(iter(model_generator.db_config.tables.values()))
-    return {field['name']: field['type'] for field in table_config.fields}
-
-def check_field_patterns(value: str, field_name: str, field_type: str) -> List[str]:
-    """Check for patterns in field values based on field type"""
-    reasons = []
-    
-    # Basic format validation based on field type
-    if field_type == 'string':
-        if not value.strip():
-            reasons.append(f"Empty {field_name}")
-    
-    # Add more type-specific validations here if needed
-    
-    return reasons
+app = FastAPI(title="Fraud Detection API", lifespan=lifespan)
+
+def get_model_generator(request: Request) -> DynamicModelGenerator:
+    """Dependency to get the model generator created at startup"""
+    return request.app.state.model_generator
+
+def get_config_snapshot(request: Request) -> ConfigSnapshot:
+    """Dependency to get the current config snapshot, fixed for the rest of the request"""
+    return request.app.state.config_store.current
 
 @app.get("/schema")
-async def get_schema(
-    model_generator: DynamicModelGenerator = Depends(get_model_generator),
-    merchant_model: type = Depends(get_merchant_model)
-):
+async def get_schema(snapshot: ConfigSnapshot = Depends(get_config_snapshot)):
     """Get the API schema"""
     try:
         # Get the model's schema
-        model_schema = merchant_model.model_json_schema()
+        model_schema = snapshot.application_model.model_json_schema()
         
         return {
             "endpoints": {
@@ -86,6 +156,10 @@ async def get_schema(
                             "field_matches": {
                                 "type": "object",
                                 "description": "Fields that matched with existing applications and their merchant IDs"
+                            },
+                            "linked_cluster": {
+                                "type": "object",
+                                "description": "Stored merchants linked to the application through shared identifiers, directly or transitively (when identity links are enabled)"
                             }
                         }
                     }
@@ -98,41 +172,65 @@ async def get_schema(
 @app.post("/predict")
 async def predict_fraud(
     application: Dict[str, Any],
+    request: Request,
     model_generator: DynamicModelGenerator = Depends(get_model_generator),
-    merchant_model: type = Depends(get_merchant_model),
-    table_fields: Dict[str, str] = Depends(get_table_fields)
+    snapshot: ConfigSnapshot = Depends(get_config_snapshot)
 ):
     """Predict fraud for a merchant application"""
+    # Malformed applications are rejected before any database work
+    errors = snapshot.validator.validate(application)
+    if errors:
+        raise HTTPException(status_code=400, detail=errors)
+    
     try:
         # Validate the application data
-        merchant_application = merchant_model(**application)
+        merchant_application = snapshot.application_model(**application)
+        case_store = request.app.state.case_store
+        identity_links = request.app.state.identity_links
+        match_keys = request.app.state.match_keys
+        
+        # Serve identical resubmissions from the cache while the case table is unchanged
+        result_cache = request.app.state.result_cache
+        if result_cache is not None:
+            cache_key = ResultCache.key("predict", merchant_application.model_dump())
+            case_generation = (case_store or model_generator).get_case_generation()
+            # A config reload also invalidates, since responses depend on the field rules
+            generation = (snapshot.version, case_generation) if case_generation is not None else None
+            cached = result_cache.get(cache_key, generation)
+            if cached is not None:
+                return cached
         
         # Get the session
         session = model_generator.get_session()
         
         try:
             # Get the table
-            table = model_generator.get_sqlalchemy_model()
+            table = request.app.state.case_model
             
             # Check for fraud patterns
             fraud_reasons = []
             field_matches = defaultdict(list)
+            failed_shards = set()
             
-            # Check each field for matches and patterns
-            for field_name, field_type in table_fields.items():
+            # Check each field for matches
+            for field_name in snapshot.field_types:
                 field_value = getattr(merchant_application, field_name)
                 
-                # Check for patterns
-                pattern_reasons = check_field_patterns(field_value, field_name, field_type)
-                fraud_reasons.extend(pattern_reasons)
-                
-                # Check for duplicate values
-                matches = session.query(table).filter(
-                    getattr(table, field_name) == field_value
-                ).all()
+                # Check for duplicate values, on the normalized match key where there is one
+                if case_store is not None:
+                    matches = case_store.find_field_matches(field_name, field_value, match_keys)
+                    failed_shards.update(matches.failed_shards)
+                    matched_ids = list(matches)
+                else:
+                    if match_keys is not None and field_name in match_keys:
+                        condition = match_keys.condition(field_name, field_value)
+                    else:
+                        condition = getattr(table, field_name) == field_value
+                    matches = session.query(table).filter(condition).all()
+                    matched_ids = [m.merchant_id for m in matches]
                 
-                if len(matches) > 0:
-                    field_matches[field_name].extend([m.merchant_id for m in matches])
+                if len(matched_ids) > 0:
+                    field_matches[field_name].extend(matched_ids)
                     fraud_reasons.append(f"Duplicate {field_name} found in previous applications")
             
             response = {
@@ -141,15 +239,38 @@ async def predict_fraud(
                 "fraud_reasons": fraud_reasons,
                 "field_matches": dict(field_matches)  # Show which fields matched with which merchant IDs
             }
+            if case_store is not None:
+                # Duplicate lookups may have missed matches on shards that did not answer
+                response["partial_results"] = bool(failed_shards)
+                response["failed_shards"] = sorted(failed_shards)
+            if identity_links is not None:
+                # The whole ring the application would join, not just direct field matches
+                response["linked_cluster"] = identity_links.find_cluster(merchant_application.model_dump())
             
             # If fraudulent, store in database
             if response["is_fraudulent"]:
-                new_entry = table(
+                entry = {
                     **merchant_application.model_dump(),
-                    fraud_reason=", ".join(fraud_reasons)
-                )
-                session.add(new_entry)
-                session.commit()
+                    "fraud_reason": ", ".join(fraud_reasons)
+                }
+                write_behind = request.app.state.write_behind
+                if write_behind is not None:
+                    # Durably queued locally, written to the table in the background
+                    write_behind.enqueue(entry)
+                elif case_store is not None:
+                    case_store.store(entry)
+                    if identity_links is not None:
+                        identity_links.link_many([entry])
+                else:
+                    session.add(table(**entry))
+                    session.flush()
+                    if identity_links is not None:
+                        identity_links.link_many([entry], session.connection())
+                    session.commit()
+            
+            # Tagged with the generation read before any lookups, so a concurrent insert invalidates it
+            if result_cache is not None and generation is not None and not failed_shards:
+                result_cache.put(cache_key, generation, response)
             
             return response
             
@@ -159,5 +280,32 @@ async def predict_fraud(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/admin/reload-config", dependencies=[Depends(require_admin_token)])
+async def reload_config(request: Request):
+    """Reload the config files now; the current config stays in place if the new one is invalid"""
+    try:
+        snapshot = request.app.state.config_store.reload()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Config not reloaded: {e}")
+    return {"version": snapshot.version, "loaded_at": snapshot.loaded_at.isoformat()}
+
+@app.get("/ready")
+def ready(request: Request):
+    """Readiness probe: 503 until this worker has warmed up
+
+    A plain def, so FastAPI runs it in the threadpool and a warm-up against an
+    unreachable database does not block the event loop.
+    """
+    if not request.app.state.ready and not warm_up(request.app):
+        raise HTTPException(status_code=503, detail="Not ready")
+    return {"ready": True, "pid": os.getpid()}
+
+@app.get("/stats/result-cache")
+async def result_cache_stats(request: Request):
+    """Hit/miss statistics of the evaluation result cache"""
+    if request.app.state.result_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **request.app.state.result_cache.stats()}
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
@@ -0,0 +1,87 @@
+import asyncio
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+
+class EvaluationBatcher:
+    """Coalesces concurrent evaluation requests into one embedding pass and one similarity query
+
+    Requests are queued until either ``max_wait_ms`` has passed since the first
+    queued request or ``max_batch_size`` requests are waiting. The batch is then
+    embedded with ``EmbeddingGenerator.transform_batch`` and searched with
+    ``Database.find_similar_cases_batch`` in a worker thread, and each caller
+    receives its own list of similar cases.
+    """
+
+    def __init__(self, embedding_generator, db, threshold: float, limit: int = 5,
+                 max_wait_ms: float = 3.0, max_batch_size: int = 32):
+        self.embedding_generator = embedding_generator
+        self.db = db
+        self.threshold = threshold
+        self.limit = limit
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.batches = 0
+        self.requests = 0
+        self._pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._in_flight: Set[asyncio.Task] = set()
+
+    async def submit(self, application: Dict[str, Any]) -> List[Tuple[str, float, dict, Optional[str]]]:
+        """Queue an application and wait for its similar cases"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((application, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self):
+        """Hand the queued requests to a background task"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+        task = asyncio.get_running_loop().create_task(self._run_batch(batch))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _run_batch(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        """Evaluate a batch off the event loop and fan the results out to the waiting requests"""
+        applications = [application for application, _ in batch]
+        self.batches += 1
+        self.requests += len(batch)
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                None, self._evaluate_batch, applications
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), cases in zip(batch, results):
+            if not future.done():
+                future.set_result(cases)
+
+    def _evaluate_batch(self, applications: List[Dict[str, Any]]):
+        """Embed all applications with one transform and search with one statement"""
+        embeddings = self.embedding_generator.transform_batch(applications)
+        return self.db.find_similar_cases_batch(
+            embeddings,
+            threshold=self.threshold,
+            limit=self.limit
+        )
+
+    async def close(self):
+        """Flush queued requests and wait for in-flight batches to finish"""
+        self._flush()
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
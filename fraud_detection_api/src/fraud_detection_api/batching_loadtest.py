@@ -0,0 +1,132 @@
+import argparse
+import asyncio
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from fraud_detection_common.config import load_config
+from fraud_detection_common.embeddings import EmbeddingGenerator
+from fraud_detection_api.batching import EvaluationBatcher
+
+try:
+    from fraud_detection_training.generate_test_data import generate_test_data
+except ImportError:
+    generate_test_data = None
+
+
+class SimulatedCaseStore:
+    """In-process stand-in for Database that charges a round trip per statement plus a search per query
+
+    A batched statement still runs one index search per query on the server, so
+    batching only saves the round trips, not the per-query cost.
+    """
+
+    def __init__(self, records: List[Dict[str, Any]], embeddings: np.ndarray, round_trip_ms: float,
+                 per_query_ms: float):
+        self.records = records
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        self.embeddings = embeddings / np.where(norms == 0, 1, norms)
+        self.round_trip = round_trip_ms / 1000.0
+        self.per_query = per_query_ms / 1000.0
+        self.statements = 0
+
+    def _search(self, embeddings: np.ndarray, threshold: float, limit: int):
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        similarities = (embeddings / np.where(norms == 0, 1, norms)) @ self.embeddings.T
+        results = []
+        for row in similarities:
+            top = np.argsort(-row)[:limit]
+            results.append([
+                (self.records[i]['merchant_id'], float(row[i]), self.records[i], self.records[i]['fraud_reason'])
+                for i in top if row[i] >= threshold
+            ])
+        return results
+
+    def find_similar_cases(self, embedding: np.ndarray, threshold: float = 0.3,
+                           limit: int = 5) -> List[Tuple[str, float, dict, Optional[str]]]:
+        self.statements += 1
+        time.sleep(self.round_trip + self.per_query)
+        return self._search(np.asarray([embedding]), threshold, limit)[0]
+
+    def find_similar_cases_batch(self, embeddings: np.ndarray, threshold: float = 0.3,
+                                 limit: int = 5) -> List[List[Tuple[str, float, dict, Optional[str]]]]:
+        self.statements += 1
+        time.sleep(self.round_trip + self.per_query * len(embeddings))
+        return self._search(np.asarray(embeddings), threshold, limit)
+
+
+async def _drive(evaluate, applications: List[Dict[str, Any]], concurrency: int) -> float:
+    """Run all applications through evaluate with a fixed number of concurrent clients"""
+    queue = list(applications)
+
+    async def client():
+        while queue:
+            await evaluate(queue.pop())
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return time.perf_counter() - start
+
+
+async def run_load_test(args):
+    if generate_test_data is None:
+        raise SystemExit("Cases are generated with the training module: pip install 'fraud_detection_api[loadtest]'")
+    config = load_config(args.config)
+    records = generate_test_data(args.records, fraud_ratio=0.1)
+    generator = EmbeddingGenerator(config.model_dump())
+    generator.fit(records)
+    store = SimulatedCaseStore(records, generator.transform_batch(records), args.round_trip_ms,
+                              args.per_query_ms)
+
+    applications = [dict(random.choice(records)) for _ in range(args.requests)]
+    threshold = config.similarity_thresholds["review"]
+    loop = asyncio.get_running_loop()
+
+    async def unbatched(application):
+        return await loop.run_in_executor(
+            None,
+            lambda: store.find_similar_cases(generator.transform(application), threshold=threshold)
+        )
+
+    store.statements = 0
+    unbatched_elapsed = await _drive(unbatched, applications, args.concurrency)
+    unbatched_statements = store.statements
+
+    batcher = EvaluationBatcher(
+        generator,
+        store,
+        threshold=threshold,
+        max_wait_ms=args.max_wait_ms,
+        max_batch_size=args.max_batch_size
+    )
+    store.statements = 0
+    batched_elapsed = await _drive(batcher.submit, applications, args.concurrency)
+    await batcher.close()
+
+    print(f"Requests: {args.requests}, concurrency: {args.concurrency}, "
+          f"round trip: {args.round_trip_ms} ms, per query: {args.per_query_ms} ms")
+    print(f"Unbatched: {args.requests / unbatched_elapsed:8.1f} req/s "
+          f"({unbatched_statements} statements)")
+    print(f"Batched:   {args.requests / batched_elapsed:8.1f} req/s "
+          f"({store.statements} statements, mean batch size {batcher.requests / max(batcher.batches, 1):.1f})")
+    print(f"Speedup:   {unbatched_elapsed / batched_elapsed:8.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare /evaluate throughput with and without micro-batching")
+    parser.add_argument("--config", help="Path to model_config.json")
+    parser.add_argument("--records", type=int, default=1000, help="Number of stored cases")
+    parser.add_argument("--requests", type=int, default=2000, help="Number of evaluation requests")
+    parser.add_argument("--concurrency", type=int, default=64, help="Number of concurrent clients")
+    parser.add_argument("--round-trip-ms", type=float, default=1.0, help="Simulated database round trip")
+    parser.add_argument("--per-query-ms", type=float, default=0.5,
+                        help="Simulated index search per query, charged for every query of a batch")
+    parser.add_argument("--max-wait-ms", type=float, default=3.0, help="Batcher max wait")
+    parser.add_argument("--max-batch-size", type=int, default=32, help="Batcher max batch size")
+    asyncio.run(run_load_test(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
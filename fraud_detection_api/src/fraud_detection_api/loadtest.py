@@ -0,0 +1,188 @@
+import argparse
+import asyncio
+import csv
+import importlib
+import random
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import httpx
+import numpy as np
+
+try:
+    from fraud_detection_training.generate_test_data import generate_test_data
+except ImportError:
+    generate_test_data = None
+
+# Identifier fields a fraud ring reuses across its applications
+RING_FIELDS = ['owner_ssn', 'business_fed_tax_id', 'business_phone_number']
+
+
+class PayloadMix:
+    """Generates application payloads with a configurable share of duplicates and fraud-ring hits
+
+    Duplicates resubmit an application that was already sent during the run, as
+    retrying clients do. Ring hits are new applications that reuse the identity
+    fields of a known fraud record, taken from the training data when given so
+    that they hit stored cases. Everything else is a fresh application.
+    """
+
+    def __init__(self, duplicate_ratio: float, ring_ratio: float, ring_source: Optional[str] = None,
+                 ring_pool_size: int = 200):
+        if generate_test_data is None:
+            raise SystemExit("Payloads are generated with the training module: pip install 'fraud_detection_api[loadtest]'")
+        self.duplicate_ratio = duplicate_ratio
+        self.ring_ratio = ring_ratio
+        if ring_source:
+            with open(ring_source, newline='') as f:
+                self.rings = [row for row in csv.DictReader(f) if row.get('fraud_reason')]
+        else:
+            self.rings = generate_test_data(ring_pool_size, fraud_ratio=1.0)
+        self.sent: List[Dict[str, Any]] = []
+
+    @staticmethod
+    def _application(record: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in record.items() if k != 'fraud_reason'}
+
+    def next(self) -> Dict[str, Any]:
+        roll = random.random()
+        if self.sent and roll < self.duplicate_ratio:
+            return dict(random.choice(self.sent))
+
+        application = self._application(generate_test_data(1, fraud_ratio=0.0)[0])
+        if roll < self.duplicate_ratio + self.ring_ratio:
+            ring = random.choice(self.rings)
+            application.update({field: ring[field] for field in RING_FIELDS})
+        application['merchant_id'] = str(uuid.uuid4())
+        self.sent.append(application)
+        return application
+
+
+class LoadTestResults:
+    """Latency, status and scheduling lag for every request sent"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.statuses: Dict[str, Dict[Any, int]] = defaultdict(lambda: defaultdict(int))
+        self.send_lag: List[float] = []
+        self.elapsed = 0.0
+
+    def record(self, endpoint: str, latency: float, status: Any, ok: bool):
+        self.latencies[endpoint].append(latency)
+        self.statuses[endpoint][status] += 1
+        if not ok:
+            self.errors[endpoint] += 1
+
+    def report(self, elapsed: float):
+        print(f"{'endpoint':<10} {'requests':>9} {'req/s':>9} {'errors':>8} "
+              f"{'p50 ms':>9} {'p99 ms':>9} {'p99.9 ms':>9} {'max ms':>9}")
+        for endpoint in sorted(self.latencies):
+            latencies = np.asarray(self.latencies[endpoint]) * 1000
+            p50, p99, p999 = np.percentile(latencies, [50, 99, 99.9])
+            print(f"{endpoint:<10} {len(latencies):>9} {len(latencies) / elapsed:>9.1f} "
+                  f"{self.errors[endpoint] / len(latencies):>8.2%} "
+                  f"{p50:>9.1f} {p99:>9.1f} {p999:>9.1f} {latencies.max():>9.1f}")
+            print(f"{'':<10} statuses: {dict(self.statuses[endpoint])}")
+        if self.send_lag:
+            # A large lag means the generator itself could not keep up with the arrival rate
+            print(f"Max send lag behind schedule: {max(self.send_lag) * 1000:.1f} ms")
+
+
+async def _send(client: httpx.AsyncClient, endpoint: str, payload: Dict[str, Any],
+                scheduled: float, results: LoadTestResults):
+    results.send_lag.append(time.perf_counter() - scheduled)
+    try:
+        response = await client.post(endpoint, json=payload)
+        status, ok = response.status_code, response.is_success
+    except httpx.HTTPError as e:
+        status, ok = type(e).__name__, False
+    # Latency is measured from the scheduled arrival so queueing delay is not hidden
+    results.record(endpoint.strip('/'), time.perf_counter() - scheduled, status, ok)
+
+
+async def run_open_loop(client: httpx.AsyncClient, args) -> LoadTestResults:
+    """Send requests at the configured arrival rate regardless of how fast responses come back"""
+    payloads = PayloadMix(args.duplicate_ratio, args.ring_ratio, args.ring_source)
+    results = LoadTestResults()
+    tasks = []
+
+    start = time.perf_counter()
+    scheduled = start
+    while scheduled - start < args.duration:
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        endpoint = "/evaluate" if random.random() < args.evaluate_ratio else "/predict"
+        tasks.append(asyncio.create_task(_send(client, endpoint, payloads.next(), scheduled, results)))
+        if args.arrivals == "poisson":
+            scheduled += random.expovariate(args.rate)
+        else:
+            scheduled += 1.0 / args.rate
+
+    await asyncio.gather(*tasks)
+    results.elapsed = time.perf_counter() - start
+    return results
+
+
+async def _check_routes(client: httpx.AsyncClient, args):
+    """Fail fast if the API does not serve an endpoint the mix sends to"""
+    endpoints = ["/predict"] + (["/evaluate"] if args.evaluate_ratio > 0 else [])
+    response = await client.get("/openapi.json")
+    response.raise_for_status()
+    missing = [endpoint for endpoint in endpoints if endpoint not in response.json().get("paths", {})]
+    if missing:
+        # /evaluate is only served by the legacy api:app
+        raise SystemExit(f"The API does not serve {', '.join(missing)}; adjust --evaluate-ratio or the target")
+
+
+def _load_app(spec: str):
+    module_name, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module_name), attr or "app")
+
+
+async def run_load_test(args):
+    random.seed(args.seed)
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    timeout = httpx.Timeout(args.timeout)
+
+    if args.app:
+        # Drive the ASGI app in-process, including its lifespan, instead of over the network
+        app = _load_app(args.app)
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=timeout) as client:
+                await _check_routes(client, args)
+                results = await run_open_loop(client, args)
+    else:
+        async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=timeout) as client:
+            await _check_routes(client, args)
+            results = await run_open_loop(client, args)
+
+    print(f"Offered {args.rate} req/s ({args.arrivals}) for {args.duration}s, "
+          f"{args.evaluate_ratio:.0%} /evaluate, {args.duplicate_ratio:.0%} duplicates, "
+          f"{args.ring_ratio:.0%} fraud-ring hits")
+    results.report(results.elapsed)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Open-loop HTTP load test for the fraud detection API")
+    parser.add_argument("--url", default="http://localhost:8000", help="Base URL of a running API")
+    parser.add_argument("--app", help="Run an ASGI app in-process instead, e.g. fraud_detection_api.api:app")
+    parser.add_argument("--rate", type=float, default=50.0, help="Offered arrival rate in requests per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to keep sending")
+    parser.add_argument("--arrivals", choices=["poisson", "constant"], default="poisson")
+    parser.add_argument("--evaluate-ratio", type=float, default=0.0, help="Share of requests sent to /evaluate")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.1, help="Share of resubmitted applications")
+    parser.add_argument("--ring-ratio", type=float, default=0.2, help="Share of applications reusing fraud-ring identifiers")
+    parser.add_argument("--ring-source", help="Training CSV whose fraud rows seed the fraud rings")
+    parser.add_argument("--max-connections", type=int, default=1000)
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(run_load_test(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
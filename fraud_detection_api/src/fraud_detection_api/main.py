@@ -0,0 +1,76 @@
+import argparse
+import gc
+import importlib
+import logging
+from typing import List, Optional
+
+import uvicorn
+
+logger = logging.getLogger(__name__)
+
+
+def load_app(app_path: str):
+    """Import an ASGI app given as module:attribute and run the module's preload hook, if any"""
+    module_name, _, attribute = app_path.partition(":")
+    module = importlib.import_module(module_name)
+    app = getattr(module, attribute or "app")
+    if hasattr(module, "preload"):
+        module.preload(app)
+    return app
+
+
+def serve_preloaded(app_path: str, host: str, port: int, workers: int):
+    """Serve with gunicorn, loading the app once in the master and forking the workers from it
+
+    Config, fitted models and embedding artifacts loaded at import time are shared
+    copy-on-write by every worker instead of being loaded once per worker.
+    """
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise SystemExit("Preloading needs gunicorn: pip install 'fraud_detection_api[preload]'")
+
+    class PreloadedServer(BaseApplication):
+        def __init__(self, app, options):
+            self.application = app
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+    app = load_app(app_path)
+    # Keep the garbage collector from touching, and so copying, the preloaded objects in each worker
+    gc.freeze()
+    PreloadedServer(app, {
+        "bind": f"{host}:{port}",
+        "workers": workers,
+        "worker_class": "uvicorn.workers.UvicornWorker",
+        "preload_app": True
+    }).run()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Run the fraud detection API")
+    parser.add_argument("--app", default="fraud_detection_api.api:app", help="ASGI app to serve, e.g. api:app")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--no-preload", action="store_true",
+                        help="Let every worker import and load the app itself, as plain uvicorn does")
+    args = parser.parse_args(argv)
+
+    if args.workers > 1 and not args.no_preload:
+        serve_preloaded(args.app, args.host, args.port, args.workers)
+    elif args.workers > 1:
+        uvicorn.run(args.app, host=args.host, port=args.port, workers=args.workers)
+    else:
+        uvicorn.run(load_app(args.app), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
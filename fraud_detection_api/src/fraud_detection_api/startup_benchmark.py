@@ -0,0 +1,113 @@
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+
+def child_pids(pid: int) -> List[int]:
+    """Get the direct children of a process (Linux)"""
+    children = Path(f"/proc/{pid}/task/{pid}/children")
+    if not children.exists():
+        return []
+    return [int(child) for child in children.read_text().split()]
+
+
+def memory_kb(pid: int) -> Dict[str, int]:
+    """Get the resident (RSS) and proportional (PSS) set size of a process in kB (Linux)
+
+    PSS divides shared pages among the processes sharing them, so it shows what
+    preloading saves where RSS counts the shared pages in every worker.
+    """
+    memory = {}
+    for path, keys in ((f"/proc/{pid}/status", {"VmRSS:": "rss"}), (f"/proc/{pid}/smaps_rollup", {"Pss:": "pss"})):
+        try:
+            for line in Path(path).read_text().splitlines():
+                name, *values = line.split()
+                if name in keys:
+                    memory[keys[name]] = int(values[0])
+        except OSError:
+            pass
+    return memory
+
+
+def wait_until_ready(url: str, workers: int, timeout: float) -> Optional[float]:
+    """Poll /ready until as many distinct workers as expected answered ready; return the seconds waited"""
+    start = time.perf_counter()
+    ready_pids = set()
+    with httpx.Client(timeout=1.0) as client:
+        while time.perf_counter() - start < timeout:
+            try:
+                response = client.get(f"{url}/ready")
+                if response.status_code == 200:
+                    ready_pids.add(response.json().get("pid"))
+                    if len(ready_pids) >= workers:
+                        return time.perf_counter() - start
+                    continue
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.05)
+    return None
+
+
+def measure(app: str, workers: int, preload: bool, port: int, timeout: float) -> dict:
+    """Start the API in one mode, time it until ready and read the memory of every process"""
+    command = [sys.executable, "-m", "fraud_detection_api.main", "--app", app,
+               "--workers", str(workers), "--port", str(port), "--host", "127.0.0.1"]
+    if not preload:
+        command.append("--no-preload")
+
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        seconds = wait_until_ready(f"http://127.0.0.1:{port}", workers, timeout)
+        # With a single worker the app runs in the server process itself
+        workers_memory = [memory for memory in map(memory_kb, child_pids(server.pid)) if memory]
+        return {
+            "mode": "preload" if preload else "per-worker",
+            "ready_seconds": seconds,
+            "master": memory_kb(server.pid),
+            "workers": workers_memory
+        }
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def print_result(result: dict):
+    ready = f"{result['ready_seconds']:.2f}s" if result["ready_seconds"] is not None else "timed out"
+    print(f"{result['mode']}: ready after {ready}")
+    print(f"  master   rss {result['master'].get('rss', 0) / 1024:8.1f} MiB"
+          f"  pss {result['master'].get('pss', 0) / 1024:8.1f} MiB")
+    for i, memory in enumerate(result["workers"]):
+        print(f"  worker {i} rss {memory.get('rss', 0) / 1024:8.1f} MiB  pss {memory.get('pss', 0) / 1024:8.1f} MiB")
+    total_pss = sum(memory.get("pss", 0) for memory in [result["master"], *result["workers"]])
+    print(f"  total pss {total_pss / 1024:.1f} MiB")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Measure API startup time and per-worker memory with and without preloading (Linux)"
+    )
+    parser.add_argument("--app", default="fraud_detection_api.api:app", help="ASGI app to serve, e.g. api:app")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds to wait for every worker to be ready")
+    parser.add_argument("--modes", nargs="+", choices=["preload", "per-worker"], default=["preload", "per-worker"])
+    args = parser.parse_args(argv)
+
+    if not os.path.exists("/proc/self/status"):
+        raise SystemExit("Memory is read from /proc, so this needs Linux")
+    for mode in args.modes:
+        print_result(measure(args.app, args.workers, mode == "preload", args.port, args.timeout))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+from typing import Any, Dict, Optional
+from sqlalchemy.dialects.postgresql import insert
+from fraud_detection_common.dynamic_model import DynamicModelGenerator
+from fraud_detection_common.sharding import ShardedCaseStore
+from fraud_detection_common.identity_links import IdentityLinkGraph
+
+logger = logging.getLogger(__name__)
+
+class WriteBehindQueue:
+    """Durable local queue of flagged applications drained into the case table in the background
+
+    Entries are appended to a SQLite database in WAL mode, so a request only waits
+    for a local commit. A background task moves them into the table in batched
+    multi-row inserts and deletes them from the queue only after Postgres has
+    committed, which gives at-least-once delivery. Redelivered entries are skipped
+    with ON CONFLICT (merchant_id) DO NOTHING.
+
+    Queued entries are not visible to duplicate lookups until they are drained.
+    """
+
+    def __init__(self, path: str, model_generator: DynamicModelGenerator, batch_size: int = 100,
+                 drain_interval_ms: float = 200.0, synchronous: str = "NORMAL",
+                 case_store: Optional[ShardedCaseStore] = None,
+                 identity_links: Optional[IdentityLinkGraph] = None):
+        self.path = path
+        self.model_generator = model_generator
+        self.case_store = case_store  # Route drained entries to their shards when sharding is enabled
+        self.identity_links = identity_links
+        self.batch_size = batch_size
+        self.drain_interval = drain_interval_ms / 1000.0
+        self._table = model_generator.get_sqlalchemy_model().__table__
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # NORMAL survives process crashes; FULL also survives power loss at the cost of an fsync per entry
+        self._conn.execute(f"PRAGMA synchronous={synchronous}")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pending (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                merchant_id TEXT NOT NULL,
+                payload TEXT NOT NULL
+            )
+        """)
+        self._conn.commit()
+        self._stopping: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def enqueue(self, entry: Dict[str, Any]):
+        """Durably append a flagged application to the queue"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO pending (merchant_id, payload) VALUES (?, ?)",
+                (entry['merchant_id'], json.dumps(entry, default=str))
+            )
+            self._conn.commit()
+
+    def pending(self) -> int:
+        """Number of entries waiting to be drained"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+
+    def drain_once(self) -> int:
+        """Move up to batch_size queued entries into the table and return how many were drained"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, payload FROM pending ORDER BY seq LIMIT ?", (self.batch_size,)
+            ).fetchall()
+        if not rows:
+            return 0
+
+        # The first entry wins for a merchant_id, both within the batch and against the table
+        entries = {}
+        for _, payload in rows:
+            entry = json.loads(payload)
+            entries.setdefault(entry['merchant_id'], entry)
+
+        if self.case_store is not None:
+            self.case_store.store_many(list(entries.values()))
+            if self.identity_links is not None:
+                # Linking is idempotent, so a redelivered batch is safe to link again
+                self.identity_links.link_many(entries.values())
+        else:
+            statement = insert(self._table).values(list(entries.values()))
+            statement = statement.on_conflict_do_nothing(index_elements=['merchant_id'])
+            with self.model_generator.engine.begin() as conn:
+                conn.execute(statement)
+                if self.identity_links is not None:
+                    self.identity_links.link_many(entries.values(), conn)
+
+        # Only forget entries once Postgres has committed them
+        with self._lock:
+            self._conn.execute("DELETE FROM pending WHERE seq <= ?", (rows[-1][0],))
+            self._conn.commit()
+        return len(rows)
+
+    def flush(self):
+        """Drain the queue until it is empty"""
+        while self.drain_once():
+            pass
+
+    def start(self):
+        """Start the background drain task on the running event loop"""
+        self._stopping = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while not self._stopping.is_set():
+            try:
+                drained = await loop.run_in_executor(None, self.drain_once)
+            except Exception:
+                logger.exception("Draining the write-behind queue failed, will retry")
+                drained = 0
+
+            # Keep draining while full batches are coming out, otherwise wait for more entries
+            if drained < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=self.drain_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def close(self):
+        """Stop the background task and flush everything still queued"""
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.flush)
+        except Exception:
+            logger.exception(f"Could not flush the write-behind queue; {self.pending()} entries remain in {self.path}")
+        finally:
+            self._conn.close()
@@ -0,0 +1,86 @@
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+import numpy as np
+from pydantic import BaseModel, Field
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from .database_config import IndexConfig
+
+# Setting that controls how much of each type of vector index a query visits, and its pgvector default
+INDEX_WIDTH_SETTINGS = {
+    "ivfflat": ("ivfflat.probes", 1),
+    "hnsw": ("hnsw.ef_search", 40)
+}
+MAX_HNSW_EF_SEARCH = 1000
+
+class CaseFilter(BaseModel):
+    """Metadata predicates applied inside the similarity query"""
+    fields: Dict[str, Union[str, List[str]]] = Field(default_factory=dict)  # Equality, or membership for a list
+    created_after: Optional[datetime] = None
+    created_before: Optional[datetime] = None
+
+    def is_empty(self) -> bool:
+        return not self.fields and self.created_after is None and self.created_before is None
+
+    def to_sql(self, allowed_fields: Iterable[str], alias: str = "t") -> Tuple[str, Dict[str, Any]]:
+        """Render the predicates as a WHERE condition with bound parameters"""
+        allowed_fields = set(allowed_fields)
+        clauses, params = [], {}
+        for i, (name, value) in enumerate(sorted(self.fields.items())):
+            # Field names are interpolated into the SQL, so only configured fields are accepted
+            if name not in allowed_fields:
+                raise ValueError(f"Cannot filter on unknown field {name}")
+            operator = "= ANY(:filter_{})" if isinstance(value, list) else "= :filter_{}"
+            clauses.append(f"{alias}.{name} {operator.format(i)}")
+            params[f"filter_{i}"] = value
+        if self.created_after is not None:
+            clauses.append(f"{alias}.created_at >= :created_after")
+            params["created_after"] = self.created_after
+        if self.created_before is not None:
+            clauses.append(f"{alias}.created_at < :created_before")
+            params["created_before"] = self.created_before
+        return " AND ".join(clauses) or "TRUE", params
+
+def find_similar_cases_filtered(conn: Connection, table: str, embedding: np.ndarray, case_filter: CaseFilter,
+                                allowed_fields: Iterable[str], threshold: float = 0.3, limit: int = 5,
+                                vector_index: Optional[IndexConfig] = None, max_rounds: int = 4,
+                                widening_factor: int = 4) -> List[Tuple[str, float, dict, Optional[str]]]:
+    """Find the top-k similar cases among the rows matching case_filter
+
+    The filter is part of the similarity query, so it is evaluated on the rows the
+    vector index visits. With a selective filter those may contain fewer than limit
+    matches; the query is then repeated with the index visiting widening_factor
+    times more (ivfflat.probes or hnsw.ef_search) until it returns limit rows, the
+    scan is exhaustive or max_rounds is reached, which bounds the latency.
+    """
+    where, params = case_filter.to_sql(allowed_fields)
+    params.update({'embedding': embedding.tolist(), 'limit': limit})
+    query = text(f"""
+        SELECT
+            t.merchant_id,
+            1 - (t.embedding <=> CAST(:embedding AS vector)) as similarity,
+            to_jsonb(t) as application_data,
+            t.fraud_reason
+        FROM {table} t
+        WHERE {where}
+        ORDER BY t.embedding <=> CAST(:embedding AS vector)
+        LIMIT :limit
+    """)
+
+    setting = None
+    if vector_index is not None and vector_index.type in INDEX_WIDTH_SETTINGS:
+        setting, default_width = INDEX_WIDTH_SETTINGS[vector_index.type]
+        # NULL until pgvector has been loaded into this backend
+        current = conn.execute(text("SELECT current_setting(:setting, true)"), {'setting': setting}).scalar()
+        width = int(current or default_width)
+        max_width = (vector_index.lists or 100) if vector_index.type == "ivfflat" else MAX_HNSW_EF_SEARCH
+
+    for _ in range(max_rounds):
+        rows = conn.execute(query, params).fetchall()
+        if setting is None or len(rows) >= limit or width >= max_width:
+            break
+        # SET LOCAL only lasts until the end of this connection's transaction
+        width = min(width * widening_factor, max_width)
+        conn.execute(text(f"SET LOCAL {setting} = {width}"))
+
+    return [tuple(row) for row in rows if row.similarity >= threshold]
@@ -0,0 +1,354 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from .database_config import CompactionConfig
+
+logger = logging.getLogger(__name__)
+
+def centroids_table(table: str) -> str:
+    return f"{table}_centroids"
+
+def members_table(table: str) -> str:
+    return f"{table}_centroid_members"
+
+def compaction_state_table(table: str) -> str:
+    return f"{table}_compaction"
+
+def create_compaction_tables(conn: Connection, schema: str, table_name: str, embedding_dim: int):
+    """Create the centroid, membership and state tables of a case table"""
+    table = f"{schema}.{table_name}"
+    conn.execute(text(f"""
+        DROP TABLE IF EXISTS {centroids_table(table)}, {members_table(table)}, {compaction_state_table(table)},
+            {centroids_table(table)}_next, {members_table(table)}_next;
+        CREATE TABLE {centroids_table(table)} (
+            centroid_id INTEGER PRIMARY KEY,
+            embedding vector({embedding_dim}) NOT NULL,
+            member_sum vector({embedding_dim}) NOT NULL,  -- Sum of the unit member vectors, for incremental means
+            representative_id VARCHAR NOT NULL,
+            size INTEGER NOT NULL
+        );
+        CREATE TABLE {members_table(table)} (
+            merchant_id VARCHAR PRIMARY KEY,
+            centroid_id INTEGER NOT NULL,
+            similarity REAL NOT NULL
+        );
+        CREATE TABLE {compaction_state_table(table)} (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            last_id BIGINT NOT NULL DEFAULT 0,  -- Cases with a higher id are not clustered yet
+            compacted_at TIMESTAMP WITH TIME ZONE
+        );
+        INSERT INTO {compaction_state_table(table)} DEFAULT VALUES;
+    """))
+    _create_centroid_indexes(conn, centroids_table(table), members_table(table), table_name)
+
+def _create_centroid_indexes(conn: Connection, centroids: str, members: str, table_name: str, suffix: str = ""):
+    # hnsw needs no data to build, so centroids added by later runs are indexed as they arrive
+    conn.execute(text(f"""
+        CREATE INDEX idx_{table_name}_centroid_members_centroid_id{suffix} ON {members} (centroid_id);
+        CREATE INDEX idx_{table_name}_centroids_embedding{suffix}
+        ON {centroids} USING hnsw (embedding vector_cosine_ops);
+    """))
+
+class LeaderClustering:
+    """Single-pass clustering of unit vectors around the first vector of each cluster
+
+    A vector joins the cluster whose leader it is most similar to if that
+    similarity reaches the threshold, and starts a new cluster otherwise. Each
+    cluster's centroid is the normalized mean of its members. Leaders and sums
+    live in preallocated arrays that double when full.
+    """
+
+    def __init__(self, threshold: float, chunk_size: int = 4096):
+        self.threshold = threshold
+        self.chunk_size = chunk_size  # Leaders compared with a batch at once, bounding batch x leaders memory
+        self.count = 0
+        self._leaders: Optional[np.ndarray] = None
+        self._sums: Optional[np.ndarray] = None
+        self.members: List[List[Tuple[str, float]]] = []
+
+    def _add_leader(self, vector: np.ndarray) -> int:
+        if self._leaders is None:
+            self._leaders = np.empty((1024, len(vector)), dtype=np.float32)
+            self._sums = np.zeros_like(self._leaders)
+        elif self.count == len(self._leaders):
+            self._leaders = np.concatenate([self._leaders, np.empty_like(self._leaders)])
+            self._sums = np.concatenate([self._sums, np.zeros_like(self._sums)])
+        self._leaders[self.count] = vector
+        self.members.append([])
+        self.count += 1
+        return self.count - 1
+
+    def _best_leaders(self, vectors: np.ndarray, stop: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the most similar of the first stop leaders for each vector, comparing a chunk at a time"""
+        best = np.zeros(len(vectors), dtype=np.int64)
+        best_similarity = np.full(len(vectors), -np.inf, dtype=np.float32)
+        rows = np.arange(len(vectors))
+        for start in range(0, stop, self.chunk_size):
+            similarities = vectors @ self._leaders[start:min(start + self.chunk_size, stop)].T
+            chunk_best = similarities.argmax(axis=1)
+            chunk_similarity = similarities[rows, chunk_best]
+            better = chunk_similarity > best_similarity
+            best[better] = start + chunk_best[better]
+            best_similarity[better] = chunk_similarity[better]
+        return best, best_similarity
+
+    def add_batch(self, merchant_ids: List[str], embeddings: np.ndarray):
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        vectors = (embeddings / np.where(norms == 0, 1, norms)).astype(np.float32)
+        first_new = self.count
+        best, best_similarity = self._best_leaders(vectors, first_new)
+
+        for i, (merchant_id, vector) in enumerate(zip(merchant_ids, vectors)):
+            cluster, similarity = None, -1.0
+            if best_similarity[i] >= self.threshold:
+                cluster, similarity = int(best[i]), float(best_similarity[i])
+            # Leaders started earlier in this batch
+            if self.count > first_new:
+                new_similarities = self._leaders[first_new:self.count] @ vector
+                j = int(new_similarities.argmax())
+                if new_similarities[j] >= self.threshold and new_similarities[j] > similarity:
+                    cluster, similarity = first_new + j, float(new_similarities[j])
+            if cluster is None:
+                cluster, similarity = self._add_leader(vector), 1.0
+            self._sums[cluster] += vector
+            self.members[cluster].append((merchant_id, similarity))
+
+    def sums(self) -> np.ndarray:
+        return self._sums[:self.count]
+
+    def centroids(self) -> np.ndarray:
+        return _unit(self.sums())
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True).clip(min=1e-12)
+
+def _nearest_centroids(conn: Connection, centroids: str, vectors: np.ndarray,
+                       chunk_size: int = 500) -> Tuple[np.ndarray, np.ndarray]:
+    """Get the nearest centroid id and its similarity for each vector, -1 where there are no centroids"""
+    nearest = np.full(len(vectors), -1, dtype=np.int64)
+    similarity = np.full(len(vectors), -np.inf, dtype=np.float32)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = vectors[start:start + chunk_size]
+        values = ", ".join(f"({i}, CAST(:embedding_{i} AS vector))" for i in range(len(chunk)))
+        result = conn.execute(text(f"""
+            SELECT q.query_id, c.centroid_id, 1 - (c.embedding <=> q.embedding) AS similarity
+            FROM (VALUES {values}) AS q(query_id, embedding)
+            CROSS JOIN LATERAL (
+                SELECT centroid_id, embedding
+                FROM {centroids}
+                ORDER BY embedding <=> q.embedding
+                LIMIT 1
+            ) c
+        """), {f'embedding_{i}': vector.tolist() for i, vector in enumerate(chunk)})
+        for query_id, centroid_id, centroid_similarity in result:
+            nearest[start + query_id] = centroid_id
+            similarity[start + query_id] = centroid_similarity
+    return nearest, similarity
+
+def _assign_batch(conn: Connection, centroids: str, members: str, merchant_ids: List[str],
+                  embeddings: np.ndarray, threshold: float) -> int:
+    """Add a batch of cases to their nearest centroids or to new ones; return how many centroids were added"""
+    vectors = _unit(embeddings.astype(np.float32))
+    nearest, similarity = _nearest_centroids(conn, centroids, vectors)
+    joins = similarity >= threshold
+
+    # Cases near an existing centroid move its mean towards them
+    joined = sorted(set(nearest[joins].tolist()))
+    if joined:
+        sums = {
+            row.centroid_id: np.asarray(row.member_sum, dtype=np.float32)
+            for row in conn.execute(text(f"""
+                SELECT centroid_id, member_sum::real[] AS member_sum FROM {centroids}
+                WHERE centroid_id = ANY(CAST(:ids AS integer[]))
+                FOR UPDATE
+            """), {'ids': joined})
+        }
+        added = {centroid_id: 0 for centroid_id in joined}
+        for i in np.flatnonzero(joins):
+            sums[int(nearest[i])] += vectors[i]
+            added[int(nearest[i])] += 1
+        conn.execute(text(f"""
+            UPDATE {centroids}
+            SET embedding = CAST(:embedding AS vector), member_sum = CAST(:member_sum AS vector), size = size + :added
+            WHERE centroid_id = :centroid_id
+        """), [
+            {'centroid_id': centroid_id, 'embedding': _unit(sums[centroid_id]).tolist(),
+             'member_sum': sums[centroid_id].tolist(), 'added': added[centroid_id]}
+            for centroid_id in joined
+        ])
+    member_rows = [
+        {'merchant_id': merchant_ids[i], 'centroid_id': int(nearest[i]), 'similarity': float(similarity[i])}
+        for i in np.flatnonzero(joins)
+    ]
+
+    # The others are clustered among themselves, which only compares them with this batch's leaders
+    rest = np.flatnonzero(~joins)
+    clustering = LeaderClustering(threshold)
+    if len(rest):
+        clustering.add_batch([merchant_ids[i] for i in rest], vectors[rest])
+        first_id = conn.execute(text(f"SELECT COALESCE(MAX(centroid_id), -1) + 1 FROM {centroids}")).scalar_one()
+        conn.execute(text(f"""
+            INSERT INTO {centroids} (centroid_id, embedding, member_sum, representative_id, size)
+            VALUES (:centroid_id, CAST(:embedding AS vector), CAST(:member_sum AS vector), :representative_id, :size)
+        """), [
+            {'centroid_id': first_id + cluster, 'embedding': centroid.tolist(), 'member_sum': member_sum.tolist(),
+             'representative_id': clustering.members[cluster][0][0], 'size': len(clustering.members[cluster])}
+            for cluster, (centroid, member_sum) in enumerate(zip(clustering.centroids(), clustering.sums()))
+        ])
+        member_rows += [
+            {'merchant_id': merchant_id, 'centroid_id': first_id + cluster, 'similarity': cluster_similarity}
+            for cluster, cluster_members in enumerate(clustering.members)
+            for merchant_id, cluster_similarity in cluster_members
+        ]
+
+    if member_rows:
+        conn.execute(text(f"""
+            INSERT INTO {members} (merchant_id, centroid_id, similarity)
+            VALUES (:merchant_id, :centroid_id, :similarity)
+            ON CONFLICT (merchant_id) DO NOTHING
+        """), member_rows)
+    return clustering.count
+
+def compact_cases(engine: Engine, schema: str, table_name: str, config: CompactionConfig,
+                  full: bool = False) -> Dict[str, int]:
+    """Cluster the cases stored since the last run into centroids; with full, re-cluster every case
+
+    Each batch of cases is matched to its nearest centroid through the centroid
+    index and joins it at similarity_threshold, moving the centroid's mean; the
+    rest start new clusters led by the first of them in the batch. So every case
+    is compared with one indexed centroid lookup plus the new leaders of its own
+    batch, instead of with every cluster. Incremental runs commit each batch with
+    the last clustered id to the live tables, so searches are never blocked and
+    an interrupted run resumes where it stopped. A full run builds new tables and
+    swaps them in at the end.
+    """
+    table = f"{schema}.{table_name}"
+    centroids, members = centroids_table(table), members_table(table)
+    if full:
+        # Build the new clusters next to the live tables, which searches keep reading meanwhile
+        centroids, members = f"{centroids}_next", f"{members}_next"
+        with engine.begin() as conn:
+            conn.execute(text(f"""
+                DROP TABLE IF EXISTS {centroids}, {members};
+                CREATE TABLE {centroids} (LIKE {centroids_table(table)} INCLUDING DEFAULTS);
+                CREATE TABLE {members} (LIKE {members_table(table)} INCLUDING DEFAULTS);
+                ALTER TABLE {centroids} ADD CONSTRAINT {centroids_table(table_name)}_next_pkey PRIMARY KEY (centroid_id);
+                ALTER TABLE {members} ADD CONSTRAINT {members_table(table_name)}_next_pkey PRIMARY KEY (merchant_id);
+            """))
+            _create_centroid_indexes(conn, centroids, members, table_name, suffix="_next")
+        last_id = 0
+    else:
+        with engine.connect() as conn:
+            last_id = conn.execute(text(f"SELECT last_id FROM {compaction_state_table(table)}")).scalar_one()
+
+    cases, new_centroids = 0, 0
+    with engine.connect() as read_conn:
+        result = read_conn.execution_options(stream_results=True, yield_per=config.batch_size).execute(text(f"""
+            SELECT id, merchant_id, embedding::real[] AS embedding
+            FROM {table}
+            WHERE id > :last_id AND embedding IS NOT NULL
+            ORDER BY id
+        """), {'last_id': last_id})
+        for rows in result.partitions():
+            with engine.begin() as conn:
+                new_centroids += _assign_batch(
+                    conn, centroids, members, [row.merchant_id for row in rows],
+                    np.asarray([row.embedding for row in rows], dtype=np.float32), config.similarity_threshold
+                )
+                last_id = rows[-1].id
+                if not full:
+                    conn.execute(text(f"""
+                        UPDATE {compaction_state_table(table)} SET last_id = :last_id, compacted_at = now()
+                    """), {'last_id': last_id})
+                    # Cached search results were ranked against the old clusters
+                    conn.execute(text(f"UPDATE {table}_generation SET generation = generation + 1"))
+            cases += len(rows)
+
+    if full:
+        # Swap them in; searches only wait for this catalog change
+        with engine.begin() as conn:
+            conn.execute(text(f"""
+                DROP TABLE {centroids_table(table)}, {members_table(table)};
+                ALTER TABLE {centroids} RENAME TO {centroids_table(table_name)};
+                ALTER TABLE {members} RENAME TO {members_table(table_name)};
+                ALTER TABLE {centroids_table(table)} RENAME CONSTRAINT {centroids_table(table_name)}_next_pkey
+                    TO {centroids_table(table_name)}_pkey;
+                ALTER TABLE {members_table(table)} RENAME CONSTRAINT {members_table(table_name)}_next_pkey
+                    TO {members_table(table_name)}_pkey;
+                ALTER INDEX {schema}.idx_{table_name}_centroids_embedding_next
+                    RENAME TO idx_{table_name}_centroids_embedding;
+                ALTER INDEX {schema}.idx_{table_name}_centroid_members_centroid_id_next
+                    RENAME TO idx_{table_name}_centroid_members_centroid_id;
+            """))
+            conn.execute(text(f"""
+                UPDATE {compaction_state_table(table)} SET last_id = :last_id, compacted_at = now()
+            """), {'last_id': last_id})
+            conn.execute(text(f"UPDATE {table}_generation SET generation = generation + 1"))
+
+    with engine.connect() as conn:
+        total_centroids, largest_cluster = conn.execute(text(f"""
+            SELECT COUNT(*), COALESCE(MAX(size), 0) FROM {centroids_table(table)}
+        """)).one()
+    stats = {
+        'cases': cases,
+        'new_centroids': new_centroids,
+        'centroids': total_centroids,
+        'largest_cluster': largest_cluster
+    }
+    logger.info(f"Compacted {table}: {stats}")
+    return stats
+
+def find_similar_cases_compacted(conn: Connection, table: str, embedding: np.ndarray, threshold: float = 0.3,
+                                 limit: int = 5, centroid_candidates: int = 20
+                                 ) -> List[Tuple[str, float, dict, Optional[str]]]:
+    """Find similar cases through the centroid index, at most one per cluster unless more are needed
+
+    The nearest centroids are expanded to their members, ranked by their own
+    similarity. The best member of every cluster comes first, so near-duplicates
+    of one fraud ring cannot crowd out other cases; later members only fill
+    remaining places. Cases stored since the last compaction are searched
+    directly and count as their own clusters.
+    """
+    result = conn.execute(text(f"""
+        WITH nearest AS (
+            SELECT centroid_id
+            FROM {centroids_table(table)}
+            ORDER BY embedding <=> CAST(:embedding AS vector)
+            LIMIT :centroid_candidates
+        ),
+        candidates AS (
+            SELECT
+                t.merchant_id,
+                1 - (t.embedding <=> CAST(:embedding AS vector)) as similarity,
+                to_jsonb(t) as application_data,
+                t.fraud_reason,
+                ROW_NUMBER() OVER (
+                    PARTITION BY m.centroid_id ORDER BY t.embedding <=> CAST(:embedding AS vector)
+                ) as member_rank
+            FROM nearest c
+            JOIN {members_table(table)} m ON m.centroid_id = c.centroid_id
+            JOIN {table} t ON t.merchant_id = m.merchant_id
+            UNION ALL
+            SELECT
+                t.merchant_id,
+                1 - (t.embedding <=> CAST(:embedding AS vector)) as similarity,
+                to_jsonb(t) as application_data,
+                t.fraud_reason,
+                1 as member_rank
+            FROM {table} t
+            WHERE t.id > (SELECT last_id FROM {compaction_state_table(table)}) AND t.embedding IS NOT NULL
+        )
+        SELECT merchant_id, similarity, application_data, fraud_reason
+        FROM candidates
+        WHERE similarity >= :threshold
+        ORDER BY member_rank, similarity DESC
+        LIMIT :limit
+    """), {
+        'embedding': embedding.tolist(),
+        'threshold': threshold,
+        'limit': limit,
+        'centroid_candidates': max(centroid_candidates, limit)
+    })
+    return [tuple(row) for row in result]
@@ -1,10 +1,12 @@
 import os
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 from .config_schema import ModelConfig
 
+@lru_cache(maxsize=1)
 def get_project_root() -> Path:
-    """Get the root directory of the project"""
+    """Get the root directory of the project, found once per process"""
     # Start from the current file and go up until we find the root marker (like pyproject.toml or .git)
     current = Path(__file__).resolve()
     for parent in [current, *current.parents]:
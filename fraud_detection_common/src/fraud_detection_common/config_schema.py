@@ -1,5 +1,5 @@
-from typing import List, Dict, Optional, Literal
-from pydantic import BaseModel, Field
+from typing import List, Dict, Optional, Literal, Union
+from pydantic import BaseModel, ConfigDict, Field
 
 class FieldConfig(BaseModel):
     """Configuration for a single field in the model"""
@@ -8,15 +8,41 @@ class FieldConfig(BaseModel):
     required: bool = True
     description: Optional[str] = None
     validation_rules: Optional[Dict] = None
+    transformer: Optional[Literal["onehot", "hashing", "tfidf", "scaler"]] = None  # Embedding transformer, tfidf if unset
+    transformer_params: Optional[Dict] = None  # Overrides for the transformer, e.g. {"n_features": 4096}
+
+class PreprocessingConfig(BaseModel):
+    """Normalization steps that derive a feature group's match keys
+
+    Each step is either a flag for all fields of the group or a list of the
+    fields it applies to. Steps run in declaration order.
+    """
+    model_config = ConfigDict(extra='forbid')
+
+    normalize: Union[bool, List[str]] = False  # Collapse whitespace, trim and lowercase
+    digits_only: Union[bool, List[str]] = False
+    email: Union[bool, List[str]] = False  # Lowercase and drop the +tag of the local part
+    hash: Union[bool, List[str]] = False  # Store an md5 digest instead of the normalized value
 
 class FeatureGroup(BaseModel):
     """Configuration for a group of features"""
     name: str
     description: Optional[str] = None
     fields: List[str]  # List of field names that belong to this feature group
-    preprocessing: Optional[Dict] = None  # Custom preprocessing steps for this group
+    preprocessing: Optional[PreprocessingConfig] = None  # Match-key normalization for this group's fields
     weight: float = 1.0  # Weight for this feature group in similarity calculation
 
+class BatchingConfig(BaseModel):
+    """Configuration for micro-batching of concurrent evaluation requests"""
+    enabled: bool = False
+    max_wait_ms: float = Field(default=3.0, gt=0)  # How long the first request in a batch may wait
+    max_batch_size: int = Field(default=32, ge=1)  # Flush as soon as this many requests are queued
+
+class EmbeddingCacheConfig(BaseModel):
+    """Configuration for the per-feature-group embedding cache"""
+    enabled: bool = True
+    max_entries: int = Field(default=50_000, ge=1)
+
 class ModelConfig(BaseModel):
     """Configuration for the entire model"""
     name: str
@@ -31,6 +57,8 @@ class ModelConfig(BaseModel):
         }
     )
     preprocessing_config: Optional[Dict] = None  # Global preprocessing configuration
+    batching: BatchingConfig = Field(default_factory=BatchingConfig)
+    embedding_cache: EmbeddingCacheConfig = Field(default_factory=EmbeddingCacheConfig)
 
 # Example configuration
 EXAMPLE_CONFIG = {
@@ -0,0 +1,139 @@
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from types import MappingProxyType
+from typing import Callable, List, Mapping, Optional, Type, Union
+from pydantic import BaseModel, create_model
+from .config import load_config
+from .config_schema import ModelConfig
+from .database_config import DatabaseConfig, load_database_config
+from .validation import RecordValidator
+
+logger = logging.getLogger(__name__)
+
+PathLike = Union[str, Path]
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """Immutable, compiled view of the database and model configuration files
+
+    Everything a request needs from the configuration is derived once here, so
+    reading it on the hot path costs nothing beyond an attribute lookup.
+    """
+    version: int
+    loaded_at: datetime
+    database: DatabaseConfig
+    model: Optional[ModelConfig]
+    field_types: Mapping[str, str]  # Case table fields and their configured types
+    validator: RecordValidator  # Required flags, types and patterns of the model fields
+    application_model: Type[BaseModel]  # Request model: every case table field plus merchant_id
+
+    @classmethod
+    def compile(cls, database_config_path: PathLike, model_config_path: Optional[PathLike] = None,
+                version: int = 1) -> "ConfigSnapshot":
+        """Load and validate the configuration files and derive everything requests use"""
+        database = load_database_config(str(database_config_path))
+        model = load_config(str(model_config_path)) if model_config_path is not None else None
+
+        table_config = next(iter(database.tables.values()))
+        field_types = {field['name']: field['type'] for field in table_config.fields}
+
+        if model is not None:
+            validator = RecordValidator.from_model_config(model)
+        else:
+            validator = RecordValidator.from_field_types(field_types)
+
+        application_fields = {name: (str, ...) for name in field_types}
+        application_fields['merchant_id'] = (str, ...)
+
+        return cls(
+            version=version,
+            loaded_at=datetime.now(timezone.utc),
+            database=database,
+            model=model,
+            field_types=MappingProxyType(field_types),
+            validator=validator,
+            application_model=create_model('MerchantApplication', **application_fields)
+        )
+
+class ConfigStore:
+    """Holds the current ConfigSnapshot and swaps in a new one when the files change
+
+    Readers take store.current once per request and use that snapshot throughout,
+    so a reload never mixes old and new settings within a request. A reload that
+    fails to load or validate leaves the current snapshot in place. Connection,
+    table and sharding settings are bound when the app starts and still need a
+    restart; thresholds, validation rules and field maps take effect on reload.
+    """
+
+    def __init__(self, database_config_path: PathLike, model_config_path: Optional[PathLike] = None):
+        self.database_config_path = Path(database_config_path)
+        self.model_config_path = Path(model_config_path) if model_config_path is not None else None
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[ConfigSnapshot], None]] = []
+        self._mtimes = self._read_mtimes()
+        self._current = ConfigSnapshot.compile(self.database_config_path, self.model_config_path)
+        self._stopping = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+
+    @property
+    def current(self) -> ConfigSnapshot:
+        return self._current
+
+    def subscribe(self, listener: Callable[[ConfigSnapshot], None]):
+        """Call listener with every snapshot swapped in after this point"""
+        self._listeners.append(listener)
+
+    def _read_mtimes(self):
+        paths = [self.database_config_path, self.model_config_path]
+        return tuple(os.stat(path).st_mtime_ns for path in paths if path is not None)
+
+    def reload(self) -> ConfigSnapshot:
+        """Compile the configuration files into a new snapshot and swap it in"""
+        with self._lock:
+            # Read before compiling, so a write during the compile is picked up by the next check
+            mtimes = self._read_mtimes()
+            snapshot = ConfigSnapshot.compile(
+                self.database_config_path, self.model_config_path, version=self._current.version + 1
+            )
+            self._current = snapshot
+            self._mtimes = mtimes
+            for listener in self._listeners:
+                listener(snapshot)
+        logger.info(f"Loaded configuration version {snapshot.version}")
+        return snapshot
+
+    def reload_if_changed(self) -> bool:
+        """Reload if a configuration file was modified since the last load; return whether it was"""
+        mtimes = self._read_mtimes()
+        if mtimes == self._mtimes:
+            return False
+        try:
+            self.reload()
+        except Exception:
+            # Only retried after the next modification
+            self._mtimes = mtimes
+            logger.exception(f"Invalid configuration, keeping version {self._current.version}")
+            return False
+        return True
+
+    def watch(self, interval_seconds: float = 5.0):
+        """Poll the configuration files in a background thread and reload when they change"""
+        def run():
+            while not self._stopping.wait(interval_seconds):
+                try:
+                    self.reload_if_changed()
+                except OSError:
+                    logger.exception("Could not check the configuration files")
+
+        self._watcher = threading.Thread(target=run, name="config-watcher", daemon=True)
+        self._watcher.start()
+
+    def close(self):
+        self._stopping.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
@@ -1,5 +1,5 @@
-from typing import List, Dict, Optional
-from pydantic import BaseModel, Field
+from typing import List, Dict, Optional, Literal
+from pydantic import BaseModel, Field, model_validator
 from pathlib import Path
 import json
 import os
@@ -15,19 +15,119 @@ class ConnectionConfig(BaseModel):
 class IndexConfig(BaseModel):
     name: str
     type: str
-    column: str
+    column: Optional[str] = None
     lists: Optional[int] = None
+    columns: Optional[List[str]] = None  # Composite btree index, e.g. ["country", "state"], instead of column
+    where: Optional[str] = None  # Partial index predicate, e.g. "country = 'US'"
+    m: Optional[int] = Field(default=None, ge=2)  # hnsw links per node, pgvector default 16
+    ef_construction: Optional[int] = Field(default=None, ge=4)  # hnsw build candidate list, pgvector default 64
+
+    def vector_method_sql(self, column: str = "embedding") -> str:
+        """Get the access method, operator class and storage parameters of a vector index on column"""
+        if self.type == "ivfflat":
+            return f"ivfflat ({column} vector_cosine_ops) WITH (lists = {self.lists or 100})"
+        parameters = ", ".join(
+            f"{name} = {value}" for name, value in (("m", self.m), ("ef_construction", self.ef_construction))
+            if value is not None
+        )
+        return f"hnsw ({column} vector_cosine_ops)" + (f" WITH ({parameters})" if parameters else "")
 
 class TableConfig(BaseModel):
     schema: str
     fields: List[Dict[str, str]] = Field(default_factory=list)
     indexes: List[IndexConfig] = Field(default_factory=list)
 
+    def vector_index(self) -> Optional[IndexConfig]:
+        """Get the first full (non-partial) index on the embedding column"""
+        for index in self.indexes:
+            if index.type in ("ivfflat", "hnsw") and index.where is None:
+                return index
+        return None
+
+class WriteBehindConfig(BaseModel):
+    """Configuration for queueing flagged applications locally before they are written"""
+    enabled: bool = False
+    queue_path: str = "write_behind_queue.sqlite3"
+    batch_size: int = Field(default=100, ge=1)
+    drain_interval_ms: float = Field(default=200.0, gt=0)
+    synchronous: Literal["NORMAL", "FULL"] = "NORMAL"
+
+class ShardConfig(BaseModel):
+    name: str
+    url: str
+
+class ShardingConfig(BaseModel):
+    """Configuration for hash-sharding the case table across several databases"""
+    shards: List[ShardConfig] = Field(min_length=1)
+    timeout_seconds: float = Field(default=5.0, gt=0)  # Shards slower than this are reported as failed
+
+class ResultCacheConfig(BaseModel):
+    """Configuration for caching evaluation responses until the case table changes"""
+    enabled: bool = False
+    max_entries: int = Field(default=10_000, ge=1)
+    ttl_seconds: float = Field(default=300.0, gt=0)
+
+class IdentityFieldConfig(BaseModel):
+    name: str
+    kind: Optional[str] = None  # Fields of the same kind link to each other, e.g. business and owner phone numbers
+    # match_keys steps applied to the value; the field's feature-group preprocessing if unset
+    normalize: Optional[List[Literal["normalize", "digits_only", "email"]]] = None
+
+class IdentityLinkConfig(BaseModel):
+    """Configuration for the graph linking merchants that share an identifier"""
+    fields: List[IdentityFieldConfig] = Field(min_length=1)
+
+class GroupVectorConfig(BaseModel):
+    """Configuration for storing one indexed vector column per feature group"""
+    groups: List[str] = Field(min_length=1)  # Feature groups of the model config, stored as embedding_{group}
+    lists: int = Field(default=100, ge=1)  # ivfflat lists of each group index
+    candidates_per_group: int = Field(default=50, ge=1)  # Nearest neighbours taken from each group index
+
+class RetentionConfig(BaseModel):
+    """Configuration for moving old cases from the case table into its archive table"""
+    max_age_days: Optional[int] = Field(default=None, ge=1)  # Archive every case older than this
+    unconfirmed_max_age_days: Optional[int] = Field(default=None, ge=1)  # Sooner for cases without a fraud_reason
+    archive_lists: Optional[int] = Field(default=None, ge=1)  # ivfflat lists of the archive, no vector index if unset
+    batch_size: int = Field(default=1000, ge=1)  # Cases moved per transaction
+    batch_pause_ms: float = Field(default=50.0, ge=0)  # Pause between transactions
+
+    @model_validator(mode='after')
+    def check_policy(self) -> "RetentionConfig":
+        if self.max_age_days is None and self.unconfirmed_max_age_days is None:
+            raise ValueError("retention needs max_age_days or unconfirmed_max_age_days")
+        return self
+
+class CompactionConfig(BaseModel):
+    """Configuration for clustering near-duplicate cases behind indexed centroids"""
+    similarity_threshold: float = Field(default=0.95, gt=0, le=1)  # Cases at least this similar share a centroid
+    centroid_candidates: int = Field(default=20, ge=1)  # Nearest centroids expanded per search
+    batch_size: int = Field(default=10_000, ge=1)  # Cases read per batch by the compaction job
+
+class ConfigReloadConfig(BaseModel):
+    """Configuration for picking up edited config files without a restart"""
+    watch: bool = False
+    interval_seconds: float = Field(default=5.0, gt=0)
+
 class DatabaseConfig(BaseModel):
     """Configuration for the entire database"""
     connection: ConnectionConfig
     tables: Dict[str, TableConfig]
     extensions: List[str] = Field(default_factory=list)
+    write_behind: WriteBehindConfig = Field(default_factory=WriteBehindConfig)
+    sharding: Optional[ShardingConfig] = None
+    result_cache: ResultCacheConfig = Field(default_factory=ResultCacheConfig)
+    identity_links: Optional[IdentityLinkConfig] = None
+    group_vectors: Optional[GroupVectorConfig] = None
+    config_reload: ConfigReloadConfig = Field(default_factory=ConfigReloadConfig)
+    retention: Optional[RetentionConfig] = None
+    compaction: Optional[CompactionConfig] = None
+
+    @model_validator(mode='after')
+    def check_compaction(self) -> "DatabaseConfig":
+        # Sharded searches scatter over the case tables and never read the centroids
+        if self.compaction is not None and self.sharding is not None:
+            raise ValueError("compaction is not supported for sharded case tables")
+        return self
 
 def load_database_config(config_path: Optional[str] = None) -> DatabaseConfig:
     """Load database configuration from file and environment variables"""
@@ -10,9 +10,26 @@ from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.sql import func
 import numpy as np
 from .database_config import load_database_config, TableConfig, DatabaseConfig
+from .match_keys import MatchKeys
+from .group_vectors import create_group_vector_columns, group_column
+from .retention import create_archive_table
+from .compaction import create_compaction_tables
 
 Base = declarative_base()
 
+# Writes to the re-embedding shadow column alone are maintenance, not a change to the case
+UPDATED_AT_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION update_updated_at_column()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        IF to_jsonb(NEW) - 'embedding_next' IS DISTINCT FROM to_jsonb(OLD) - 'embedding_next' THEN
+            NEW.updated_at = CURRENT_TIMESTAMP;
+        END IF;
+        RETURN NEW;
+    END;
+    $$ language 'plpgsql';
+"""
+
 class Vector(UserDefinedType):
     """PostgreSQL vector type for storing embeddings"""
     
@@ -32,8 +49,8 @@ class Vector(UserDefinedType):
 class DynamicModelGenerator:
     """Generates SQLAlchemy models dynamically based on configuration"""
     
-    def __init__(self, config_path: Optional[str] = None):
-        self.db_config = load_database_config(config_path)
+    def __init__(self, config_path: Optional[str] = None, db_config: Optional[DatabaseConfig] = None):
+        self.db_config = db_config or load_database_config(config_path)
         self.engine = create_engine(
             self.db_config.connection.url,
             pool_size=self.db_config.connection.pool_size,
@@ -76,6 +93,11 @@ class DynamicModelGenerator:
             'updated_at': Column(DateTime(timezone=True), onupdate=func.now())
         })
 
+        # One vector column per feature group in the per-group layout
+        if self.db_config.group_vectors is not None:
+            for group in self.db_config.group_vectors.groups:
+                field_definitions[group_column(group)] = Column(Vector)
+
         # Create model class
         model = type(
             'MerchantFraud',  # Use a fixed name since we only have one table
@@ -116,24 +138,27 @@ class DynamicModelGenerator:
         """Get the generated Pydantic model"""
         return self._create_pydantic_model()
 
-    def create_tables(self):
-        """Create all tables defined in the configuration"""
+    def create_tables(self, embedding_dim: int, match_keys: Optional[MatchKeys] = None,
+                      group_dims: Optional[Dict[str, int]] = None):
+        """Create all tables defined in the configuration
+
+        embedding_dim is the output dimension of the fitted embedding generator,
+        as recorded in its model artifact. match_keys adds the normalized
+        match-key columns derived from the model config's feature groups, and
+        group_dims sizes the per-group vector columns when group_vectors is set.
+        """
         for table_name, table_config in self.db_config.tables.items():
-            self._create_table(table_name, table_config)
+            self._create_table(table_name, table_config, embedding_dim, match_keys, group_dims)
         self.metadata.create_all(self.engine)
 
-    def _create_table(self, table_name: str, table_config: TableConfig):
+    def _create_table(self, table_name: str, table_config: TableConfig, embedding_dim: int,
+                      match_keys: Optional[MatchKeys] = None, group_dims: Optional[Dict[str, int]] = None):
         """Create a single table with its indexes"""
         # Create the vector extension first
         with self.engine.connect() as conn:
             conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector;"))
             conn.commit()
 
-        # Get embedding dimension from config
-        embedding_dim = 384  # Default value
-        if hasattr(self.db_config, 'embedding_dim'):
-            embedding_dim = self.db_config.embedding_dim
-
         # Build the field definitions
         field_definitions = []
         for field in table_config.fields:
@@ -148,8 +173,9 @@ class DynamicModelGenerator:
 
         # Drop and create the table with vector dimensions
         with self.engine.connect() as conn:
-            # Drop the table if it exists
+            # Drop the table if it exists, with the state of any re-embedding migration of it
             conn.execute(text(f"DROP TABLE IF EXISTS {table_config.schema}.{table_name} CASCADE;"))
+            conn.execute(text(f"DROP TABLE IF EXISTS {table_config.schema}.{table_name}_reembed;"))
             conn.commit()
 
             # Create the table
@@ -169,28 +195,46 @@ class DynamicModelGenerator:
 
             # Create indexes
             for index_config in table_config.indexes:
-                if index_config.type == 'ivfflat':
+                # Partial indexes serve queries whose filters imply the predicate
+                where_sql = f" WHERE {index_config.where}" if index_config.where else ""
+                if index_config.type in ('ivfflat', 'hnsw'):
                     conn.execute(text(f"""
                         CREATE INDEX IF NOT EXISTS {index_config.name}
-                        ON {table_config.schema}.{table_name} USING ivfflat (embedding vector_cosine_ops)
-                        WITH (lists = {index_config.lists or 100});
+                        ON {table_config.schema}.{table_name} USING {index_config.vector_method_sql()}{where_sql};
                     """))
-                elif index_config.type == 'btree' and index_config.column:
+                elif index_config.type == 'btree' and (index_config.columns or index_config.column):
+                    columns = ", ".join(index_config.columns or [index_config.column])
                     conn.execute(text(f"""
                         CREATE INDEX IF NOT EXISTS {index_config.name}
-                        ON {table_config.schema}.{table_name} ({index_config.column});
+                        ON {table_config.schema}.{table_name} ({columns}){where_sql};
                     """))
                 conn.commit()
 
+            # Create the generated match-key columns and their indexes
+            if match_keys is not None:
+                match_keys.create_columns(conn, table_config.schema, table_name)
+                conn.commit()
+
+            # Create the per-group vector columns and their indexes
+            if self.db_config.group_vectors is not None:
+                create_group_vector_columns(
+                    conn, table_config.schema, table_name, group_dims or {}, self.db_config.group_vectors
+                )
+                conn.commit()
+
+            # Create the archive table last, since it copies the case table's columns
+            if self.db_config.retention is not None:
+                create_archive_table(conn, table_config.schema, table_name, self.db_config.retention)
+                conn.commit()
+
+            # Create the near-duplicate centroid tables, filled by the compaction job
+            if self.db_config.compaction is not None:
+                create_compaction_tables(conn, table_config.schema, table_name, embedding_dim)
+                conn.commit()
+
             # Create trigger for updating updated_at
             conn.execute(text(f"""
-                CREATE OR REPLACE FUNCTION update_updated_at_column()
-                RETURNS TRIGGER AS $$
-                BEGIN
-                    NEW.updated_at = CURRENT_TIMESTAMP;
-                    RETURN NEW;
-                END;
-                $$ language 'plpgsql';
+                {UPDATED_AT_FUNCTION_SQL}
 
                 DROP TRIGGER IF EXISTS update_{table_name}_updated_at ON {table_config.schema}.{table_name};
                 CREATE TRIGGER update_{table_name}_updated_at
@@ -200,6 +244,40 @@ class DynamicModelGenerator:
             """))
             conn.commit()
 
+            # Create the write generation counter, bumped in the writing transaction so that
+            # a new generation becomes visible exactly when the new rows do
+            conn.execute(text(f"""
+                DROP TABLE IF EXISTS {table_config.schema}.{table_name}_generation;
+                CREATE TABLE {table_config.schema}.{table_name}_generation (
+                    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                    generation BIGINT NOT NULL DEFAULT 0
+                );
+                INSERT INTO {table_config.schema}.{table_name}_generation DEFAULT VALUES;
+
+                CREATE OR REPLACE FUNCTION bump_{table_name}_generation()
+                RETURNS TRIGGER AS $$
+                BEGIN
+                    UPDATE {table_config.schema}.{table_name}_generation SET generation = generation + 1;
+                    RETURN NULL;
+                END;
+                $$ language 'plpgsql';
+
+                DROP TRIGGER IF EXISTS bump_{table_name}_generation ON {table_config.schema}.{table_name};
+                CREATE TRIGGER bump_{table_name}_generation
+                    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table_config.schema}.{table_name}
+                    FOR EACH STATEMENT
+                    EXECUTE FUNCTION bump_{table_name}_generation();
+            """))
+            conn.commit()
+
+    def get_case_generation(self) -> int:
+        """Get the write generation of the case table, bumped by every statement that changes it"""
+        table_name, table_config = next(iter(self.db_config.tables.items()))
+        with self.engine.connect() as conn:
+            return conn.execute(text(
+                f"SELECT generation FROM {table_config.schema}.{table_name}_generation"
+            )).scalar_one()
+
     def get_session(self):
         """Get a new database session"""
         return self.Session()
@@ -0,0 +1,76 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Sequence
+
+class GroupEmbeddingCache:
+    """Bounded LRU cache of weighted feature-group vectors
+
+    Entries are keyed by the group name and a hash of the group's field values,
+    so applications that share a whole group (the same location, a phone number
+    reused by a fraud ring) skip that group's pipeline. The cache belongs to one
+    fitted generator at a time; attaching it to another one clears it.
+    """
+
+    def __init__(self, max_entries: int = 50_000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[bytes, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generator = None
+
+    @staticmethod
+    def key(group_name: str, values: Sequence[Any]) -> bytes:
+        """Hash of a group's field values in a canonical serialization"""
+        payload = json.dumps([group_name, list(values)], default=str, separators=(',', ':'))
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).digest()
+
+    def get(self, key: bytes, owner=None) -> Optional[Any]:
+        """Look up a vector; lookups on behalf of a generator that is no longer attached always miss"""
+        with self._lock:
+            vector = self._entries.get(key) if owner is None or owner is self._generator else None
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, key: bytes, vector: Any, owner=None):
+        """Store a vector unless it was computed by a generator that is no longer attached"""
+        with self._lock:
+            if owner is not None and owner is not self._generator:
+                return
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop all entries and reset the stats"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def attach(self, generator):
+        """Serve generator's group vectors from this cache, discarding vectors of any previous generator"""
+        if self._generator is not None and self._generator is not generator:
+            # A previous generator still serving in-flight requests must not repopulate the cache
+            self._generator.group_cache = None
+        self.clear()
+        self._generator = generator
+        generator.group_cache = self
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "max_entries": self.max_entries
+            }
@@ -1,11 +1,16 @@
 import json
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 from sklearn.pipeline import Pipeline
 from sklearn.compose import ColumnTransformer
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
 from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer
-from sklearn.decomposition import PCA
+from sklearn.random_projection import SparseRandomProjection
+from .match_keys import STEPS
+
+# Match-key steps that also canonicalize the text the pipelines see; hashing would destroy its n-grams
+EMBEDDING_STEPS = ("normalize", "digits_only", "email")
 
 class EmbeddingGenerator:
     def __init__(self, config):
@@ -13,7 +18,13 @@ class EmbeddingGenerator:
         self.embedding_dim = config.get("embedding_dim", 128)
         self.group_pipelines = {}
         self.group_weights = {}
-        self.pca = None
+        self.group_fields = {}
+        self.field_steps = {}  # Field name -> match-key steps applied before the group pipelines
+        self.group_cache = None  # Optional GroupEmbeddingCache shared by everyone using this generator
+        self.projection = None
+        self.output_dim = None  # Width of the vectors produced by transform, known after fit
+        self.group_projections = {}
+        self.group_output_dims = {}  # Width of each group's vectors from transform_groups_batch
         self._build_group_pipelines()
 
     def _build_group_pipelines(self):
@@ -24,54 +35,153 @@ class EmbeddingGenerator:
             for fname in group["fields"]:
                 fconfig = field_configs[fname]
                 ttype = fconfig.get("transformer")
-                transformers.append(self._make_transformer(fname, ttype))
-            group_transformer = ColumnTransformer(transformers, remainder='drop', sparse_threshold=0.3)
+                params = fconfig.get("transformer_params") or {}
+                transformers.append(self._make_transformer(fname, ttype, params))
+            # sparse_threshold=1.0 keeps the group output sparse whenever any transformer is sparse
+            group_transformer = ColumnTransformer(transformers, remainder='drop', sparse_threshold=1.0)
             pipeline = Pipeline([("transform", group_transformer)])
             self.group_pipelines[group["name"]] = pipeline
             self.group_weights[group["name"]] = group.get("weight", 1.0)
+            self.group_fields[group["name"]] = list(group["fields"])
+            preprocessing = group.get("preprocessing") or {}
+            for fname in group["fields"]:
+                steps = [
+                    step for step in EMBEDDING_STEPS
+                    if preprocessing.get(step) is True or fname in (preprocessing.get(step) or [])
+                ]
+                if steps:
+                    self.field_steps[fname] = steps
 
-    def _make_transformer(self, fname, ttype):
-        # Choose transformer by type (as specified in config)
+    def __getstate__(self):
+        # The cache is process-local and not part of a model artifact
+        state = self.__dict__.copy()
+        state["group_cache"] = None
+        return state
+
+    def _make_transformer(self, fname, ttype, params=None):
+        # Choose transformer by type (as specified in config); params override the defaults
+        params = params or {}
         if ttype == "onehot":
-            return (fname, OneHotEncoder(sparse=False, handle_unknown='ignore'), [fname])
+            return (fname, OneHotEncoder(**{"sparse_output": True, "handle_unknown": 'ignore', **params}), [fname])
         elif ttype == "hashing":
-            return (fname, HashingVectorizer(analyzer='char', ngram_range=(2, 4), n_features=8), fname)
+            return (fname, HashingVectorizer(**{"analyzer": 'char', "ngram_range": (2, 4), "n_features": 8, **params}), fname)
         elif ttype == "tfidf":
-            return (fname, TfidfVectorizer(analyzer='char', ngram_range=(2, 4), max_features=16), fname)
+            return (fname, TfidfVectorizer(**{"analyzer": 'char', "ngram_range": (2, 4), "max_features": 16, **params}), fname)
         elif ttype == "scaler":
-            return (fname, StandardScaler(), [fname])
+            return (fname, StandardScaler(**params), [fname])
         else:
-            return (fname, TfidfVectorizer(analyzer='char', ngram_range=(2, 4), max_features=8), fname)
+            return (fname, TfidfVectorizer(**{"analyzer": 'char', "ngram_range": (2, 4), "max_features": 8, **params}), fname)
+
+    def _frame(self, rows):
+        """Build the input frame, with string values canonicalized as the group's match keys are
+
+        Values that differ only in formatting then embed, and are cached, alike.
+        Artifacts fitted before preprocessing was applied have no field_steps and
+        keep seeing raw values.
+        """
+        df = pd.DataFrame(rows)
+        for fname, steps in getattr(self, "field_steps", {}).items():
+            if fname in df:
+                df[fname] = df[fname].map(lambda value: self._canonical(value, steps))
+        return df
+
+    @staticmethod
+    def _canonical(value, steps):
+        if not isinstance(value, str):
+            return value
+        for step in steps:
+            value = STEPS[step](value)
+        return value
 
     def fit(self, data):
-        df = pd.DataFrame(data)
+        df = self._frame(data)
         for group_name, pipeline in self.group_pipelines.items():
             pipeline.fit(df)
-        all_embeds = np.array([self._raw_embedding(row) for row in data])
+        group_blocks = self._group_blocks(df)
+        all_embeds = sp.hstack(list(group_blocks.values()), format="csr", dtype=np.float32)
         if all_embeds.shape[1] > self.embedding_dim:
-            self.pca = PCA(n_components=self.embedding_dim)
-            self.pca.fit(all_embeds)
+            # Cost of fitting and applying the projection scales with non-zeros, not raw width
+            self.projection = SparseRandomProjection(
+                n_components=self.embedding_dim,
+                dense_output=True,
+                random_state=0
+            )
+            self.projection.fit(all_embeds)
+            self.output_dim = self.embedding_dim
+        else:
+            # Short embeddings keep their true width instead of being zero-padded
+            self.output_dim = all_embeds.shape[1]
+
+        # Per-group vectors are projected on their own when a group alone is wider than embedding_dim
+        self.group_projections = {}
+        self.group_output_dims = {}
+        for group_name, block in group_blocks.items():
+            if block.shape[1] > self.embedding_dim:
+                self.group_projections[group_name] = SparseRandomProjection(
+                    n_components=self.embedding_dim,
+                    dense_output=True,
+                    random_state=0
+                ).fit(block)
+                self.group_output_dims[group_name] = self.embedding_dim
+            else:
+                self.group_output_dims[group_name] = block.shape[1]
 
     def transform(self, row):
-        raw_emb = self._raw_embedding(row)
-        if self.pca:
-            return self.pca.transform([raw_emb])[0]
-        # Pad if too short, trim if too long
-        if len(raw_emb) < self.embedding_dim:
-            return np.pad(raw_emb, (0, self.embedding_dim - len(raw_emb)))
-        elif len(raw_emb) > self.embedding_dim:
-            return raw_emb[:self.embedding_dim]
-        else:
-            return raw_emb
+        return self.transform_batch([row])[0]
+
+    def transform_batch(self, rows):
+        # One pass through each group pipeline for the whole batch
+        raw_embs = self._raw_embeddings(self._frame(rows))
+        if self.projection:
+            return self.projection.transform(raw_embs).astype(np.float32)
+        # Without a projection the raw width is at most embedding_dim, so densifying is cheap
+        return raw_embs.toarray()
+
+    def transform_groups_batch(self, rows):
+        # One vector per feature group; group weights only scale them, which cosine similarity ignores
+        group_vectors = {}
+        for group_name, block in self._group_blocks(self._frame(rows)).items():
+            projection = self.group_projections.get(group_name)
+            if projection is not None:
+                group_vectors[group_name] = projection.transform(block).astype(np.float32)
+            else:
+                group_vectors[group_name] = block.toarray()
+        return group_vectors
 
     def _raw_embedding(self, row):
-        df_row = pd.DataFrame([row])
-        group_vecs = []
+        return self._raw_embeddings(self._frame([row])).toarray()[0]
+
+    def _raw_embeddings(self, df):
+        return sp.hstack(list(self._group_blocks(df).values()), format="csr", dtype=np.float32)
+
+    def _group_blocks(self, df):
+        group_blocks = {}
+        group_cache = self.group_cache
         for group_name, pipeline in self.group_pipelines.items():
-            vec = pipeline.transform(df_row)
-            if hasattr(vec, "toarray"):
-                vec = vec.toarray()
-            vec = np.asarray(vec).flatten()
-            weighted_vec = vec * self.group_weights[group_name]
-            group_vecs.append(weighted_vec)
-        return np.concatenate(group_vecs).astype(np.float32)
\ No newline at end of file
+            if group_cache is None:
+                group_blocks[group_name] = self._weighted_group_block(group_name, pipeline, df)
+            else:
+                group_blocks[group_name] = self._cached_group_block(group_name, pipeline, df, group_cache)
+        return group_blocks
+
+    def _weighted_group_block(self, group_name, pipeline, df):
+        block = sp.csr_matrix(pipeline.transform(df), dtype=np.float32)
+        # Apply the group weight as a sparse diagonal scaling of the group's columns
+        weights = np.full(block.shape[1], self.group_weights[group_name], dtype=np.float32)
+        return (block @ sp.diags(weights)).tocsr()
+
+    def _cached_group_block(self, group_name, pipeline, df, group_cache):
+        # df is already canonicalized, so the keys are the values after the group's preprocessing
+        keys = [
+            group_cache.key(group_name, values)
+            for values in df[self.group_fields[group_name]].itertuples(index=False, name=None)
+        ]
+        rows = [group_cache.get(key, owner=self) for key in keys]
+        missing = [i for i, row in enumerate(rows) if row is None]
+        if missing:
+            # Only rows whose group values were not seen before go through the pipeline
+            computed = self._weighted_group_block(group_name, pipeline, df.iloc[missing])
+            for position, i in enumerate(missing):
+                rows[i] = computed[position]
+                group_cache.put(keys[i], rows[i], owner=self)
+        return sp.vstack(rows, format="csr")
@@ -0,0 +1,85 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from .database_config import GroupVectorConfig
+from .case_filter import CaseFilter
+
+def group_column(group_name: str) -> str:
+    return f"embedding_{group_name}"
+
+def create_group_vector_columns(conn: Connection, schema: str, table_name: str,
+                                group_dims: Dict[str, int], config: GroupVectorConfig):
+    """Add one vector column and ivfflat index per configured feature group"""
+    missing = [group for group in config.groups if group not in group_dims]
+    if missing:
+        raise ValueError(f"No embedding dimension known for feature groups {missing}")
+
+    for group in config.groups:
+        column = group_column(group)
+        conn.execute(text(f"""
+            ALTER TABLE {schema}.{table_name}
+            ADD COLUMN IF NOT EXISTS {column} vector({group_dims[group]})
+        """))
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS idx_{table_name}_{column}
+            ON {schema}.{table_name} USING ivfflat ({column} vector_cosine_ops)
+            WITH (lists = {config.lists})
+        """))
+
+def find_similar_cases_by_group(conn: Connection, table: str, group_embeddings: Dict[str, np.ndarray],
+                                weights: Dict[str, float], threshold: float = 0.3, limit: int = 5,
+                                candidates_per_group: int = 50, case_filter: Optional[CaseFilter] = None,
+                                allowed_fields: Iterable[str] = ()) -> List[Tuple[str, float, dict, Optional[str]]]:
+    """Find the top-k cases by the weighted mean of their per-group cosine similarities
+
+    Every group with a positive weight contributes its candidates_per_group nearest
+    neighbours from its own index, and the union is rescored with the query's
+    weights, so changing the weighting needs no re-embedding.
+    """
+    unknown = [group for group in weights if group not in group_embeddings]
+    if unknown:
+        raise ValueError(f"Unknown feature groups {unknown}")
+    groups = [group for group, weight in weights.items() if weight > 0]
+    if not groups:
+        raise ValueError("At least one feature group needs a positive weight")
+
+    where, params = (case_filter or CaseFilter()).to_sql(allowed_fields)
+    candidate_queries, scores = [], []
+    for i, group in enumerate(groups):
+        distance = f"t.{group_column(group)} <=> CAST(:query_{i} AS vector)"
+        candidate_queries.append(
+            f"(SELECT t.merchant_id FROM {table} t WHERE {where} ORDER BY {distance} LIMIT :candidates)"
+        )
+        # pgvector returns NaN for zero vectors, e.g. a group whose fields were all empty
+        scores.append(f":weight_{i} * COALESCE(NULLIF(1 - ({distance}), 'NaN'), 0)")
+        params[f"query_{i}"] = group_embeddings[group].tolist()
+        params[f"weight_{i}"] = weights[group]
+    params.update({
+        'candidates': candidates_per_group,
+        'total_weight': sum(weights[group] for group in groups),
+        'threshold': threshold,
+        'limit': limit
+    })
+
+    union_sql = "\nUNION\n".join(candidate_queries)
+    score_sql = " + ".join(scores)
+    result = conn.execute(text(f"""
+        WITH candidates AS (
+            {union_sql}
+        )
+        SELECT merchant_id, similarity, application_data, fraud_reason
+        FROM (
+            SELECT
+                t.merchant_id,
+                ({score_sql}) / :total_weight as similarity,
+                to_jsonb(t) as application_data,
+                t.fraud_reason
+            FROM {table} t
+            JOIN candidates c ON c.merchant_id = t.merchant_id
+        ) scored
+        WHERE similarity >= :threshold
+        ORDER BY similarity DESC
+        LIMIT :limit
+    """), params)
+    return [tuple(row) for row in result]
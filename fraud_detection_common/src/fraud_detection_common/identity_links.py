@@ -0,0 +1,227 @@
+import logging
+from contextlib import nullcontext
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from .database_config import IdentityLinkConfig
+from .dynamic_model import DynamicModelGenerator
+from .match_keys import MatchKeys
+
+logger = logging.getLogger(__name__)
+
+class UnionFind:
+    """Disjoint sets over merchant_ids with path compression and union by size"""
+
+    def __init__(self):
+        self.parent: Dict[str, str] = {}
+        self.size: Dict[str, int] = {}
+
+    def add(self, item: str):
+        if item not in self.parent:
+            self.parent[item] = item
+            self.size[item] = 1
+
+    def find(self, item: str) -> str:
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, a: str, b: str):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return
+        if self.size[root_a] < self.size[root_b]:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        self.size[root_a] += self.size[root_b]
+
+class IdentityLinkGraph:
+    """Links merchants that share a normalized identifier and keeps connected-component ids
+
+    {table}_identity_links maps (identifier kind, normalized identifier) to the
+    merchants using it, and {table}_clusters maps every linked merchant to the id
+    of its connected component. Both are maintained whenever cases are inserted,
+    so the whole ring an application would join is found with one indexed lookup.
+    Incremental maintenance is serialized with an advisory lock; rebuild recomputes
+    everything from the case table.
+    """
+
+    def __init__(self, model_generator: DynamicModelGenerator, link_config: IdentityLinkConfig,
+                 match_keys: Optional[MatchKeys] = None):
+        self.engine = model_generator.engine
+        table_name, table_config = next(iter(model_generator.db_config.tables.items()))
+        self.case_table = f"{table_config.schema}.{table_name}"
+        self.links_table = f"{table_config.schema}.{table_name}_identity_links"
+        self.clusters_table = f"{table_config.schema}.{table_name}_clusters"
+        self._lock_name = f"{table_config.schema}.{table_name}_clusters"
+        self.fields = [(field.name, field.kind or field.name) for field in link_config.fields]
+        # Identifiers are keyed like the match-key columns, unless a field overrides the steps
+        configured = match_keys.steps if match_keys is not None else {}
+        self.keys = MatchKeys({
+            field.name: field.normalize or configured.get(field.name, ["normalize"])
+            for field in link_config.fields
+        })
+
+    def identifier_keys(self, application: Mapping[str, Any]) -> List[Tuple[str, str]]:
+        """Get the (kind, normalized identifier) pairs of an application"""
+        keys = set()
+        for name, kind in self.fields:
+            key = self.keys.key(name, application.get(name))
+            if key:
+                keys.add((kind, key))
+        return sorted(keys)
+
+    @staticmethod
+    def _key_params(keys: List[Tuple[str, str]]) -> Dict[str, List[str]]:
+        return {'kinds': [kind for kind, _ in keys], 'keys': [key for _, key in keys]}
+
+    def create_tables(self):
+        """Create the link and cluster tables if they do not exist"""
+        with self.engine.begin() as conn:
+            conn.execute(text(f"""
+                CREATE TABLE IF NOT EXISTS {self.links_table} (
+                    identifier_kind VARCHAR NOT NULL,
+                    identifier_key VARCHAR NOT NULL,
+                    merchant_id VARCHAR NOT NULL,
+                    PRIMARY KEY (identifier_kind, identifier_key, merchant_id)
+                );
+                CREATE TABLE IF NOT EXISTS {self.clusters_table} (
+                    merchant_id VARCHAR PRIMARY KEY,
+                    cluster_id VARCHAR NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS {self.clusters_table.split('.')[-1]}_cluster_id
+                    ON {self.clusters_table} (cluster_id);
+            """))
+
+    def link_many(self, entries: Iterable[Mapping[str, Any]], conn: Optional[Connection] = None):
+        """Add newly stored cases to the graph, in conn's transaction if given"""
+        if conn is None:
+            with self.engine.begin() as conn:
+                return self.link_many(entries, conn)
+
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:lock_name))"), {'lock_name': self._lock_name})
+        for entry in entries:
+            self._link(conn, entry['merchant_id'], self.identifier_keys(entry))
+
+    def _link(self, conn: Connection, merchant_id: str, keys: List[Tuple[str, str]]):
+        clusters = []
+        if keys:
+            conn.execute(text(f"""
+                INSERT INTO {self.links_table} (identifier_kind, identifier_key, merchant_id)
+                VALUES (:kind, :key, :merchant_id)
+                ON CONFLICT DO NOTHING
+            """), [{'kind': kind, 'key': key, 'merchant_id': merchant_id} for kind, key in keys])
+
+            # Every cluster reachable through one of the identifiers, largest first
+            clusters = conn.execute(text(f"""
+                SELECT cluster_id, COUNT(*) AS size
+                FROM {self.clusters_table}
+                WHERE cluster_id IN (
+                    SELECT c.cluster_id
+                    FROM {self.links_table} l
+                    JOIN {self.clusters_table} c ON c.merchant_id = l.merchant_id
+                    WHERE (l.identifier_kind, l.identifier_key) IN (
+                        SELECT * FROM unnest(CAST(:kinds AS varchar[]), CAST(:keys AS varchar[]))
+                    )
+                )
+                GROUP BY cluster_id
+                ORDER BY size DESC, cluster_id
+            """), self._key_params(keys)).fetchall()
+
+        # Union: relabel the smaller clusters into the largest one
+        target = clusters[0].cluster_id if clusters else merchant_id
+        others = [cluster.cluster_id for cluster in clusters[1:]]
+        if others:
+            conn.execute(text(f"""
+                UPDATE {self.clusters_table} SET cluster_id = :target
+                WHERE cluster_id = ANY(CAST(:others AS varchar[]))
+            """), {'target': target, 'others': others})
+        conn.execute(text(f"""
+            INSERT INTO {self.clusters_table} (merchant_id, cluster_id)
+            VALUES (:merchant_id, :cluster_id)
+            ON CONFLICT (merchant_id) DO UPDATE SET cluster_id = EXCLUDED.cluster_id
+        """), {'merchant_id': merchant_id, 'cluster_id': target})
+
+    def find_cluster(self, application: Mapping[str, Any]) -> Dict[str, Any]:
+        """Get every stored merchant linked to the application's identifiers, directly or transitively"""
+        keys = self.identifier_keys(application)
+        if not keys:
+            return {"cluster_ids": [], "merchant_ids": [], "size": 0}
+
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(f"""
+                SELECT DISTINCT members.cluster_id, members.merchant_id
+                FROM {self.links_table} l
+                JOIN {self.clusters_table} c ON c.merchant_id = l.merchant_id
+                JOIN {self.clusters_table} members ON members.cluster_id = c.cluster_id
+                WHERE (l.identifier_kind, l.identifier_key) IN (
+                    SELECT * FROM unnest(CAST(:kinds AS varchar[]), CAST(:keys AS varchar[]))
+                )
+            """), self._key_params(keys)).fetchall()
+
+        merchant_ids = sorted({row.merchant_id for row in rows} - {application.get('merchant_id')})
+        return {
+            "cluster_ids": sorted({row.cluster_id for row in rows}),
+            "merchant_ids": merchant_ids,
+            "size": len(merchant_ids)
+        }
+
+    def rebuild(self, engines: Optional[List[Engine]] = None, batch_size: int = 10_000) -> Dict[str, int]:
+        """Recompute links and clusters from the stored cases on the given engines (all shards)
+
+        The advisory lock is held from before the scan until the new tables commit,
+        so cases linked meanwhile wait and are added on top of the rebuilt graph
+        instead of being lost to the truncate.
+        """
+        engines = engines or [self.engine]
+        columns = ", ".join(sorted({name for name, _ in self.fields}))
+        components = UnionFind()
+        first_merchant_by_key: Dict[Tuple[str, str], str] = {}
+        links = []
+
+        with self.engine.begin() as conn:
+            conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:lock_name))"), {'lock_name': self._lock_name})
+            for engine in engines:
+                # The primary database is scanned in the locked transaction itself
+                with (nullcontext(conn) if engine is self.engine else engine.connect()) as scan_conn:
+                    result = scan_conn.execute(
+                        text(f"SELECT merchant_id, {columns} FROM {self.case_table}"),
+                        execution_options={'stream_results': True, 'yield_per': batch_size}
+                    )
+                    for row in result.mappings():
+                        merchant_id = row['merchant_id']
+                        components.add(merchant_id)
+                        for key in self.identifier_keys(row):
+                            links.append({'kind': key[0], 'key': key[1], 'merchant_id': merchant_id})
+                            if key in first_merchant_by_key:
+                                components.union(first_merchant_by_key[key], merchant_id)
+                            else:
+                                first_merchant_by_key[key] = merchant_id
+
+            clusters = [
+                {'merchant_id': merchant_id, 'cluster_id': components.find(merchant_id)}
+                for merchant_id in components.parent
+            ]
+            conn.execute(text(f"TRUNCATE {self.links_table}, {self.clusters_table}"))
+            for start in range(0, len(links), batch_size):
+                conn.execute(text(f"""
+                    INSERT INTO {self.links_table} (identifier_kind, identifier_key, merchant_id)
+                    VALUES (:kind, :key, :merchant_id)
+                    ON CONFLICT DO NOTHING
+                """), links[start:start + batch_size])
+            for start in range(0, len(clusters), batch_size):
+                conn.execute(text(f"""
+                    INSERT INTO {self.clusters_table} (merchant_id, cluster_id)
+                    VALUES (:merchant_id, :cluster_id)
+                """), clusters[start:start + batch_size])
+
+        stats = {
+            "merchants": len(clusters),
+            "links": len(links),
+            "clusters": len({cluster['cluster_id'] for cluster in clusters})
+        }
+        logger.info(f"Rebuilt identity links: {stats}")
+        return stats
@@ -0,0 +1,110 @@
+import hashlib
+import re
+from typing import Any, Callable, Dict, List, Mapping, Optional, Union
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql.elements import TextClause
+from .config_schema import ModelConfig
+
+def normalize(value: str) -> str:
+    return re.sub(r"\s+", " ", value).strip().lower()
+
+def digits_only(value: str) -> str:
+    return re.sub(r"[^0-9]", "", value)
+
+def canonical_email(value: str) -> str:
+    return re.sub(r"\+[^@]*@", "@", re.sub(r"\s", "", value).lower(), count=1)
+
+def md5_hex(value: str) -> str:
+    return hashlib.md5(value.encode('utf-8')).hexdigest()
+
+# Steps in the order they are applied, as Python functions and as the equivalent SQL
+STEPS: Dict[str, Callable[[str], str]] = {
+    "normalize": normalize,
+    "digits_only": digits_only,
+    "email": canonical_email,
+    "hash": md5_hex
+}
+SQL_STEPS: Dict[str, Callable[[str], str]] = {
+    "normalize": lambda sql: rf"lower(btrim(regexp_replace({sql}, '\s+', ' ', 'g')))",
+    "digits_only": lambda sql: f"regexp_replace({sql}, '[^0-9]', '', 'g')",
+    "email": lambda sql: rf"regexp_replace(lower(regexp_replace({sql}, '\s', '', 'g')), '\+[^@]*@', '@')",
+    "hash": lambda sql: f"md5({sql})"
+}
+
+def _applies(setting: Union[bool, List[str]], field: str) -> bool:
+    return setting if isinstance(setting, bool) else field in setting
+
+class MatchKeys:
+    """Normalized match-key columns derived from FeatureGroup.preprocessing
+
+    Every field with preprocessing steps gets a {field}_key column that Postgres
+    generates from the raw value, so all insert paths fill it, plus a btree index
+    (hash for hashed keys). Duplicate lookups compare the key column with the same
+    expression applied to the bound value, which makes them indexed equality probes
+    that agree with the stored keys by construction. key() is the Python equivalent
+    for comparing fetched rows; both agree on ASCII input.
+    """
+
+    def __init__(self, steps: Dict[str, List[str]]):
+        self.steps = steps  # Field name -> step names in application order
+
+    @classmethod
+    def from_model_config(cls, config: ModelConfig) -> "MatchKeys":
+        steps = {}
+        for group in config.feature_groups:
+            if group.preprocessing is None:
+                continue
+            for field in group.fields:
+                field_steps = [step for step in STEPS if _applies(getattr(group.preprocessing, step), field)]
+                if field_steps:
+                    steps[field] = field_steps
+        return cls(steps)
+
+    def __contains__(self, field: str) -> bool:
+        return field in self.steps
+
+    @staticmethod
+    def column(field: str) -> str:
+        return f"{field}_key"
+
+    def key(self, field: str, value: Any) -> Optional[str]:
+        """Compute field's match key for a raw value"""
+        if value is None:
+            return None
+        key = str(value)
+        for step in self.steps[field]:
+            key = STEPS[step](key)
+        return key
+
+    def keys(self, application: Mapping[str, Any]) -> Dict[str, Optional[str]]:
+        """Compute the match keys of every keyed field present in an application"""
+        return {field: self.key(field, application[field]) for field in self.steps if field in application}
+
+    def expression(self, field: str, operand: str) -> str:
+        """SQL computing field's match key from operand"""
+        sql = f"CAST({operand} AS VARCHAR)"
+        for step in self.steps[field]:
+            sql = SQL_STEPS[step](sql)
+        return sql
+
+    def condition(self, field: str, value: Any) -> TextClause:
+        """Indexed equality probe of field's key column for a raw value"""
+        return text(
+            f"{self.column(field)} = {self.expression(field, ':match_value')}"
+        ).bindparams(match_value=value)
+
+    def create_columns(self, conn: Connection, schema: str, table_name: str):
+        """Add the generated key columns and their indexes; existing rows are keyed by Postgres"""
+        for field, steps in self.steps.items():
+            column = self.column(field)
+            conn.execute(text(f"""
+                ALTER TABLE {schema}.{table_name}
+                ADD COLUMN IF NOT EXISTS {column} VARCHAR
+                GENERATED ALWAYS AS ({self.expression(field, field)}) STORED
+            """))
+            index_type = "hash" if steps[-1] == "hash" else "btree"
+            conn.execute(text(f"""
+                CREATE INDEX IF NOT EXISTS idx_{table_name}_{column}
+                ON {schema}.{table_name} USING {index_type} ({column})
+            """))
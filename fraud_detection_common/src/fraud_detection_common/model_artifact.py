@@ -0,0 +1,61 @@
+import hashlib
+import pickle
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional, Union
+from .embeddings import EmbeddingGenerator
+from .embedding_cache import GroupEmbeddingCache
+
+class ModelArtifact:
+    """A fitted EmbeddingGenerator together with the metadata needed to serve it"""
+
+    def __init__(self, generator: EmbeddingGenerator, created_at: Optional[datetime] = None):
+        if generator.output_dim is None:
+            raise ValueError("Embedding generator must be fitted before it is stored in an artifact")
+        self.generator = generator
+        self.embedding_dim = generator.output_dim
+        self.created_at = created_at or datetime.now(timezone.utc)
+        self.path: Optional[Path] = None  # Set when loaded from disk
+
+    def save(self, path: Union[str, Path]):
+        """Write the artifact to disk"""
+        with open(path, 'wb') as f:
+            pickle.dump({
+                'generator': self.generator,
+                'embedding_dim': self.embedding_dim,
+                'created_at': self.created_at
+            }, f)
+
+    @classmethod
+    def load(cls, path: Union[str, Path], group_cache: Optional[GroupEmbeddingCache] = None) -> "ModelArtifact":
+        """Read an artifact written by save
+
+        If group_cache is given it is cleared and attached to the loaded generator,
+        so vectors cached for a previous artifact are never served.
+        """
+        path = Path(path)
+        if not path.exists():
+            raise FileNotFoundError(f"Model artifact not found at {path}")
+
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+
+        artifact = cls(data['generator'], created_at=data['created_at'])
+        if artifact.embedding_dim != data['embedding_dim']:
+            raise ValueError(
+                f"Model artifact at {path} records embedding_dim={data['embedding_dim']} "
+                f"but its generator produces {artifact.embedding_dim} dimensions"
+            )
+        artifact.path = path
+        if group_cache is not None:
+            group_cache.attach(artifact.generator)
+        return artifact
+
+    @staticmethod
+    def checksum(path: Union[str, Path]) -> str:
+        """SHA-256 of an artifact file, to tell whether two paths hold the same artifact"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
@@ -0,0 +1,264 @@
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from .dynamic_model import UPDATED_AT_FUNCTION_SQL, DynamicModelGenerator
+from .embeddings import EmbeddingGenerator
+
+logger = logging.getLogger(__name__)
+
+SHADOW_COLUMN = "embedding_next"
+
+def state_table(table: str) -> str:
+    return f"{table}_reembed"
+
+def read_reembed_state(conn: Connection, table: str, lock: bool = False) -> Optional[Dict[str, Any]]:
+    """Get the re-embedding migration of a case table, or None if it never had one
+
+    With lock, the case table is share-locked for the rest of the transaction
+    first, so a cutover cannot commit between reading the state and searching.
+    """
+    if conn.execute(text("SELECT to_regclass(:state_table)"), {'state_table': state_table(table)}).scalar() is None:
+        return None
+    if lock:
+        conn.execute(text(f"LOCK TABLE {table} IN ACCESS SHARE MODE"))
+    row = conn.execute(text(f"SELECT * FROM {state_table(table)}")).mappings().first()
+    return dict(row) if row is not None else None
+
+def reembed_progress(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Add the completed fraction, throughput and remaining time to a migration state"""
+    elapsed = (state['updated_at'] - state['started_at']).total_seconds()
+    rows_per_second = state['done'] / elapsed if elapsed > 0 else None
+    remaining = max(state['total'] - state['done'], 0)
+    return {
+        **state,
+        'progress': state['done'] / state['total'] if state['total'] else 1.0,
+        'rows_per_second': rows_per_second,
+        'eta_seconds': remaining / rows_per_second if rows_per_second else None
+    }
+
+def find_similar_cases_dual(conn: Connection, table: str, embedding: np.ndarray, next_embedding: np.ndarray,
+                            threshold: float = 0.3, limit: int = 5) -> List[Tuple[str, float, dict, Optional[str]]]:
+    """Find the top-k similar cases while a re-embedding migration is running
+
+    Rows already backfilled are ranked by their new-version vector, the others by
+    the current one; a case found by both keeps its new-version similarity.
+    """
+    result = conn.execute(text(f"""
+        SELECT merchant_id, similarity, application_data, fraud_reason
+        FROM (
+            SELECT DISTINCT ON (merchant_id) *
+            FROM (
+                (
+                    SELECT
+                        t.merchant_id,
+                        1 - (t.embedding <=> CAST(:embedding AS vector)) as similarity,
+                        to_jsonb(t) - '{SHADOW_COLUMN}' as application_data,
+                        t.fraud_reason,
+                        1 as version
+                    FROM {table} t
+                    ORDER BY t.embedding <=> CAST(:embedding AS vector)
+                    LIMIT :limit
+                )
+                UNION ALL
+                (
+                    SELECT
+                        t.merchant_id,
+                        1 - (t.{SHADOW_COLUMN} <=> CAST(:next_embedding AS vector)) as similarity,
+                        to_jsonb(t) - '{SHADOW_COLUMN}' as application_data,
+                        t.fraud_reason,
+                        2 as version
+                    FROM {table} t
+                    -- Rows not backfilled yet sort last and drop out at the threshold, and leaving
+                    -- them unfiltered keeps the hnsw index on the shadow column usable
+                    ORDER BY t.{SHADOW_COLUMN} <=> CAST(:next_embedding AS vector)
+                    LIMIT :limit
+                )
+            ) candidates
+            ORDER BY merchant_id, version DESC
+        ) merged
+        WHERE similarity >= :threshold
+        ORDER BY similarity DESC
+        LIMIT :limit
+    """), {
+        'embedding': embedding.tolist(),
+        'next_embedding': next_embedding.tolist(),
+        'threshold': threshold,
+        'limit': limit
+    })
+    return [tuple(row) for row in result]
+
+class ReembedMigration:
+    """Re-embeds the stored cases with a new model artifact while the API keeps serving
+
+    New vectors are backfilled into a shadow column in throttled batches, with the
+    progress kept in a one-row state table. Searches meanwhile combine both
+    versions, ranking the shadow column through an hnsw index that is created
+    with it and grows with the backfill. The cutover swaps the shadow column and its index in for the
+    embedding column in one transaction and marks the migration complete.
+    """
+
+    def __init__(self, model_generator: DynamicModelGenerator, batch_size: int = 500,
+                 batch_pause_ms: float = 100.0):
+        db_config = model_generator.db_config
+        if db_config.sharding is not None:
+            # The migration would only rewrite the table in the primary database, which holds no cases
+            raise ValueError("Re-embedding does not cover sharded case tables; retrain instead")
+        if any(setting is not None for setting in (db_config.group_vectors, db_config.retention, db_config.compaction)):
+            raise ValueError("Re-embedding does not cover per-group vectors, the archive or centroids; retrain instead")
+        self.model_generator = model_generator
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause_ms / 1000
+        table_name, self.table_config = next(iter(db_config.tables.items()))
+        self.table = f"{self.table_config.schema}.{table_name}"
+        self.search_index = f"idx_{table_name}_{SHADOW_COLUMN}_search"
+        self.state_table = state_table(self.table)
+        self.vector_indexes = [
+            index for index in self.table_config.indexes if index.type in ("ivfflat", "hnsw")
+        ]
+
+    def state(self) -> Optional[Dict[str, Any]]:
+        with self.model_generator.engine.connect() as conn:
+            state = read_reembed_state(conn, self.table)
+        return reembed_progress(state) if state is not None else None
+
+    def start(self, artifact_path: str, embedding_dim: int):
+        """Add the shadow column and record a running migration, or resume the one for artifact_path"""
+        state = self.state()
+        if state is not None and state['status'] == 'running':
+            if state['artifact_path'] != artifact_path:
+                raise RuntimeError(f"A migration to {state['artifact_path']} is already running")
+            logger.info(f"Resuming migration to {artifact_path} at {state['done']}/{state['total']} rows")
+            return
+
+        with self.model_generator.engine.begin() as conn:
+            # Tables created before the trigger ignored the shadow column get the current version
+            conn.execute(text(UPDATED_AT_FUNCTION_SQL))
+            conn.execute(text(f"""
+                CREATE TABLE IF NOT EXISTS {self.state_table} (
+                    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                    status VARCHAR NOT NULL,
+                    artifact_path VARCHAR NOT NULL,
+                    embedding_dim INTEGER NOT NULL,
+                    total BIGINT NOT NULL,
+                    done BIGINT NOT NULL DEFAULT 0,
+                    last_id BIGINT NOT NULL DEFAULT 0,
+                    started_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+                    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+                    completed_at TIMESTAMP WITH TIME ZONE
+                );
+                DELETE FROM {self.state_table};
+                ALTER TABLE {self.table} DROP COLUMN IF EXISTS {SHADOW_COLUMN};
+                ALTER TABLE {self.table} ADD COLUMN {SHADOW_COLUMN} vector({int(embedding_dim)});
+                -- Unlike ivfflat, hnsw needs no data to build, so it serves searches from the first batch
+                CREATE INDEX {self.search_index} ON {self.table} USING hnsw ({SHADOW_COLUMN} vector_cosine_ops);
+            """))
+            conn.execute(text(f"""
+                INSERT INTO {self.state_table} (status, artifact_path, embedding_dim, total)
+                SELECT 'running', :artifact_path, :embedding_dim, count(*) FROM {self.table}
+            """), {'artifact_path': artifact_path, 'embedding_dim': embedding_dim})
+
+    def _records(self, rows) -> List[Dict[str, str]]:
+        field_names = [field['name'] for field in self.table_config.fields]
+        return [
+            {name: '' if row[name] is None else str(row[name]) for name in field_names}
+            for row in rows
+        ]
+
+    def _embed_batch(self, conn: Connection, generator: EmbeddingGenerator, where: str,
+                     params: Dict[str, Any]) -> Tuple[int, int]:
+        """Write new vectors for the next batch of rows matching where; return the count and last id"""
+        rows = conn.execute(text(f"""
+            SELECT * FROM {self.table}
+            WHERE {where}
+            ORDER BY id
+            LIMIT :batch_size
+        """), {**params, 'batch_size': self.batch_size}).mappings().all()
+        if not rows:
+            return 0, params.get('last_id', 0)
+
+        embeddings = generator.transform_batch(self._records(rows))
+        conn.execute(
+            text(f"UPDATE {self.table} SET {SHADOW_COLUMN} = CAST(:embedding AS vector) WHERE id = :id"),
+            [{'id': row['id'], 'embedding': embedding.tolist()} for row, embedding in zip(rows, embeddings)]
+        )
+        return len(rows), rows[-1]['id']
+
+    def backfill(self, generator: EmbeddingGenerator, max_batches: Optional[int] = None) -> int:
+        """Embed the rows after the recorded position in batches; return how many were embedded
+
+        Each batch and its progress are committed together, so an interrupted
+        backfill resumes where it stopped. Rows the API inserts meanwhile get
+        higher ids and are picked up by later batches.
+        """
+        embedded, batches = 0, 0
+        while max_batches is None or batches < max_batches:
+            started = time.perf_counter()
+            with self.model_generator.engine.begin() as conn:
+                last_id = conn.execute(text(f"SELECT last_id FROM {self.state_table}")).scalar_one()
+                count, last_id = self._embed_batch(conn, generator, "id > :last_id", {'last_id': last_id})
+                conn.execute(text(f"""
+                    UPDATE {self.state_table}
+                    SET done = done + :count, last_id = :last_id, updated_at = now(),
+                        total = GREATEST(total, done + :count)
+                """), {'count': count, 'last_id': last_id})
+            if count == 0:
+                break
+            embedded += count
+            batches += 1
+            state = self.state()
+            logger.info(
+                f"Re-embedded {state['done']}/{state['total']} rows ({state['progress']:.1%}), "
+                f"{count / (time.perf_counter() - started):.0f} rows/s in this batch"
+            )
+            time.sleep(self.batch_pause)
+        return embedded
+
+    def _next_index_name(self, index_name: str) -> str:
+        return f"{index_name}_next"
+
+    def build_indexes(self):
+        """Build the vector indexes on the shadow column without blocking writes"""
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+        with self.model_generator.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for index in self.vector_indexes:
+                method = index.vector_method_sql(SHADOW_COLUMN)
+                where_sql = f" WHERE {index.where}" if index.where else ""
+                conn.execute(text(f"""
+                    CREATE INDEX CONCURRENTLY IF NOT EXISTS {self._next_index_name(index.name)}
+                    ON {self.table} USING {method}{where_sql}
+                """))
+
+    def cutover(self, generator: EmbeddingGenerator):
+        """Swap the shadow column in for the embedding column and mark the migration complete
+
+        Runs in one transaction under an exclusive lock on the case table. Rows
+        inserted since the backfill finished are embedded first; the swap itself
+        only changes the catalog.
+        """
+        with self.model_generator.engine.begin() as conn:
+            conn.execute(text(f"LOCK TABLE {self.table} IN ACCESS EXCLUSIVE MODE"))
+            while self._embed_batch(conn, generator, f"{SHADOW_COLUMN} IS NULL", {})[0] == self.batch_size:
+                pass
+            schema = self.table_config.schema
+            conn.execute(text(f"DROP INDEX IF EXISTS {schema}.{self.search_index}"))
+            for index in self.vector_indexes:
+                conn.execute(text(f"DROP INDEX IF EXISTS {schema}.{index.name}"))
+            conn.execute(text(f"""
+                ALTER TABLE {self.table} DROP COLUMN embedding;
+                ALTER TABLE {self.table} RENAME COLUMN {SHADOW_COLUMN} TO embedding;
+            """))
+            for index in self.vector_indexes:
+                conn.execute(text(
+                    f"ALTER INDEX IF EXISTS {schema}.{self._next_index_name(index.name)} RENAME TO {index.name}"
+                ))
+            conn.execute(text(f"""
+                UPDATE {self.state_table}
+                SET status = 'complete', done = total, updated_at = now(), completed_at = now()
+            """))
+            # Cached search results were ranked by the old embeddings; the column swap fires no trigger
+            conn.execute(text(f"UPDATE {self.table}_generation SET generation = generation + 1"))
+        logger.info(f"Cut over {self.table} to the new embeddings at {datetime.now(timezone.utc).isoformat()}")
@@ -0,0 +1,60 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+class ResultCache:
+    """Bounded LRU cache of evaluation responses, tagged with the case table's write generation
+
+    The generation is a counter bumped in the same transaction as every statement
+    that writes to the case table (see DynamicModelGenerator._create_table). Callers
+    read it before computing a response and tag the entry with it; an entry is only
+    served while the current generation is unchanged, so a response never outlives
+    a newly committed fraud case.
+    """
+
+    def __init__(self, max_entries: int = 10_000, ttl_seconds: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[bytes, Tuple[Hashable, float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(endpoint: str, payload: Dict[str, Any]) -> bytes:
+        """Hash of an endpoint and its validated payload in a canonical serialization"""
+        canonical = json.dumps([endpoint, payload], sort_keys=True, default=str, separators=(',', ':'))
+        return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).digest()
+
+    def get(self, key: bytes, generation: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != generation or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key: bytes, generation: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (generation, time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "max_entries": self.max_entries
+            }
@@ -0,0 +1,120 @@
+import logging
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from .database_config import RetentionConfig
+from .case_filter import CaseFilter
+
+logger = logging.getLogger(__name__)
+
+def archive_table(table_name: str) -> str:
+    return f"{table_name}_archive"
+
+def create_archive_table(conn: Connection, schema: str, table_name: str, config: RetentionConfig):
+    """Create the archive table with the case table's columns and a cheaper index
+
+    Created without defaults or generated expressions, so moved rows keep their
+    ids, timestamps and match keys as plain values. Created after every column of
+    the case table, since moves copy rows by column position.
+    """
+    archive = archive_table(table_name)
+    conn.execute(text(f"""
+        DROP TABLE IF EXISTS {schema}.{archive};
+        CREATE TABLE {schema}.{archive} (LIKE {schema}.{table_name});
+        CREATE UNIQUE INDEX idx_{archive}_merchant_id ON {schema}.{archive} (merchant_id);
+        CREATE INDEX idx_{archive}_created_at ON {schema}.{archive} (created_at);
+    """))
+    if config.archive_lists is not None:
+        conn.execute(text(f"""
+            CREATE INDEX idx_{archive}_embedding
+            ON {schema}.{archive} USING ivfflat (embedding vector_cosine_ops)
+            WITH (lists = {config.archive_lists})
+        """))
+
+def retention_policy_sql(config: RetentionConfig) -> Tuple[str, Dict[str, Any]]:
+    """Render the retention policy as a WHERE condition selecting the cases to archive"""
+    clauses, params = [], {}
+    if config.max_age_days is not None:
+        clauses.append("created_at < now() - make_interval(days => :max_age_days)")
+        params['max_age_days'] = config.max_age_days
+    if config.unconfirmed_max_age_days is not None:
+        clauses.append(
+            "(COALESCE(fraud_reason, '') = '' "
+            "AND created_at < now() - make_interval(days => :unconfirmed_max_age_days))"
+        )
+        params['unconfirmed_max_age_days'] = config.unconfirmed_max_age_days
+    return " OR ".join(clauses), params
+
+def archive_expired_cases(engine: Engine, schema: str, table_name: str, config: RetentionConfig,
+                          max_batches: Optional[int] = None) -> int:
+    """Move the cases matching the retention policy into the archive; return how many were moved
+
+    Each batch is its own short transaction that deletes at most batch_size rows
+    and inserts them into the archive. Rows locked by concurrent writers are
+    skipped until a later run, so the API is never blocked behind the move.
+    """
+    where, params = retention_policy_sql(config)
+    params['batch_size'] = config.batch_size
+    query = text(f"""
+        WITH moved AS (
+            DELETE FROM {schema}.{table_name}
+            WHERE id IN (
+                SELECT id FROM {schema}.{table_name}
+                WHERE {where}
+                ORDER BY id
+                LIMIT :batch_size
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING *
+        )
+        INSERT INTO {schema}.{archive_table(table_name)}
+        SELECT * FROM moved
+    """)
+
+    total, batches = 0, 0
+    while max_batches is None or batches < max_batches:
+        with engine.begin() as conn:
+            moved = conn.execute(query, params).rowcount
+        total += moved
+        batches += 1
+        if moved < config.batch_size:
+            break
+        time.sleep(config.batch_pause_ms / 1000)
+    logger.info(f"Archived {total} cases from {schema}.{table_name} in {batches} batches")
+    return total
+
+def find_similar_cases_with_archive(conn: Connection, table: str, embedding: np.ndarray, threshold: float = 0.3,
+                                    limit: int = 5, case_filter: Optional[CaseFilter] = None,
+                                    allowed_fields: Iterable[str] = ()) -> List[Tuple[str, float, dict, Optional[str]]]:
+    """Find the top-k similar cases across the case table and its archive
+
+    Each tier contributes its own top-k, so the archive's cheaper index (or exact
+    scan) is only visited by queries that ask for it.
+    """
+    where, params = (case_filter or CaseFilter()).to_sql(allowed_fields)
+    params.update({'embedding': embedding.tolist(), 'threshold': threshold, 'limit': limit})
+    tier_queries = [
+        f"""(
+            SELECT
+                t.merchant_id,
+                1 - (t.embedding <=> CAST(:embedding AS vector)) as similarity,
+                to_jsonb(t) as application_data,
+                t.fraud_reason
+            FROM {tier} t
+            WHERE {where}
+            ORDER BY t.embedding <=> CAST(:embedding AS vector)
+            LIMIT :limit
+        )"""
+        for tier in (table, archive_table(table))
+    ]
+    union_sql = " UNION ALL ".join(tier_queries)
+    result = conn.execute(text(f"""
+        SELECT merchant_id, similarity, application_data, fraud_reason
+        FROM ({union_sql}) nearest
+        WHERE similarity >= :threshold
+        ORDER BY similarity DESC
+        LIMIT :limit
+    """), params)
+    return [tuple(row) for row in result]
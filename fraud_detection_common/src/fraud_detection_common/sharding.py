@@ -0,0 +1,270 @@
+import hashlib
+import heapq
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait
+from itertools import chain
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from .database_config import DatabaseConfig
+from .dynamic_model import DynamicModelGenerator
+from .match_keys import MatchKeys
+from .case_filter import CaseFilter, find_similar_cases_filtered
+from .group_vectors import find_similar_cases_by_group
+from .retention import find_similar_cases_with_archive
+
+logger = logging.getLogger(__name__)
+
+def shard_index(merchant_id: str, num_shards: int) -> int:
+    """Stable shard assignment for a merchant_id, independent of the process hash seed"""
+    digest = hashlib.blake2b(merchant_id.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % num_shards
+
+class ShardedResults(list):
+    """Results merged across shards; failed_shards names the shards that did not answer"""
+
+    def __init__(self, results: Iterable = (), failed_shards: Iterable[str] = ()):
+        super().__init__(results)
+        self.failed_shards = list(failed_shards)
+
+    @property
+    def partial(self) -> bool:
+        return bool(self.failed_shards)
+
+class CaseShard:
+    """One shard of the case table, backed by its own database"""
+
+    def __init__(self, name: str, model_generator: DynamicModelGenerator,
+                 statement_timeout_ms: Optional[int] = None):
+        self.name = name
+        self.model_generator = model_generator
+        self.statement_timeout_ms = statement_timeout_ms  # Bounds reads, which the scatter cannot cancel once running
+        self.table_name, self.table_config = next(iter(model_generator.db_config.tables.items()))
+        self.table = model_generator.get_sqlalchemy_model().__table__
+
+    @contextmanager
+    def _read(self):
+        """Connect for a read, cancelled by Postgres once it runs past the statement timeout"""
+        with self.model_generator.engine.connect() as conn:
+            if self.statement_timeout_ms is not None:
+                # SET LOCAL only lasts until the end of this connection's transaction
+                conn.execute(text(f"SET LOCAL statement_timeout = {int(self.statement_timeout_ms)}"))
+            yield conn
+
+    def find_similar_cases(self, embedding: np.ndarray, threshold: float = 0.3, limit: int = 5,
+                           case_filter: Optional[CaseFilter] = None,
+                           include_archive: bool = False) -> List[Tuple[str, float, dict, Optional[str]]]:
+        """Find this shard's top-k similar cases, optionally among rows matching case_filter"""
+        with self._read() as conn:
+            if include_archive:
+                return find_similar_cases_with_archive(
+                    conn, f"{self.table_config.schema}.{self.table_name}", embedding,
+                    threshold=threshold, limit=limit, case_filter=case_filter,
+                    allowed_fields=[field['name'] for field in self.table_config.fields]
+                )
+            if case_filter is not None and not case_filter.is_empty():
+                return find_similar_cases_filtered(
+                    conn, f"{self.table_config.schema}.{self.table_name}", embedding, case_filter,
+                    [field['name'] for field in self.table_config.fields],
+                    threshold=threshold, limit=limit, vector_index=self.table_config.vector_index()
+                )
+            result = conn.execute(text(f"""
+                SELECT merchant_id, similarity, application_data, fraud_reason
+                FROM (
+                    SELECT
+                        merchant_id,
+                        1 - (embedding <=> CAST(:embedding AS vector)) as similarity,
+                        to_jsonb(t) as application_data,
+                        fraud_reason
+                    FROM {self.table_config.schema}.{self.table_name} t
+                    ORDER BY embedding <=> CAST(:embedding AS vector)
+                    LIMIT :limit
+                ) nearest
+                WHERE similarity >= :threshold
+            """), {
+                'embedding': embedding.tolist(),
+                'threshold': threshold,
+                'limit': limit
+            })
+            return [tuple(row) for row in result]
+
+    def find_similar_cases_by_group(self, group_embeddings: Dict[str, np.ndarray], weights: Dict[str, float],
+                                    threshold: float = 0.3, limit: int = 5,
+                                    case_filter: Optional[CaseFilter] = None) -> List[Tuple[str, float, dict, Optional[str]]]:
+        """Find this shard's top-k cases by weighted per-group similarity"""
+        with self._read() as conn:
+            return find_similar_cases_by_group(
+                conn, f"{self.table_config.schema}.{self.table_name}", group_embeddings, weights,
+                threshold=threshold, limit=limit,
+                candidates_per_group=self.model_generator.db_config.group_vectors.candidates_per_group,
+                case_filter=case_filter,
+                allowed_fields=[field['name'] for field in self.table_config.fields]
+            )
+
+    def find_field_matches(self, field_name: str, value: Any,
+                           match_keys: Optional[MatchKeys] = None) -> List[str]:
+        """Get the merchant_ids on this shard with the same value, or match key, for a field"""
+        if match_keys is not None and field_name in match_keys:
+            condition = match_keys.condition(field_name, value)
+        else:
+            condition = self.table.c[field_name] == value
+        with self._read() as conn:
+            result = conn.execute(
+                self.table.select().with_only_columns(self.table.c.merchant_id).where(condition)
+            )
+            return [row.merchant_id for row in result]
+
+    def store_many(self, entries: List[Dict[str, Any]]):
+        """Insert entries, skipping merchant_ids that are already stored"""
+        statement = insert(self.table).values(entries).on_conflict_do_nothing(index_elements=['merchant_id'])
+        with self.model_generator.engine.begin() as conn:
+            conn.execute(statement)
+
+    def get_case_generation(self) -> int:
+        return self.model_generator.get_case_generation()
+
+    def get_embedding_dim(self) -> Optional[int]:
+        """Get the dimension of this shard's embedding column, or None if the table does not exist"""
+        with self._read() as conn:
+            return conn.execute(text("""
+                SELECT atttypmod
+                FROM pg_attribute
+                WHERE attrelid = to_regclass(:table_name) AND attname = 'embedding'
+            """), {'table_name': f"{self.table_config.schema}.{self.table_name}"}).scalar()
+
+    def create_tables(self, embedding_dim: int, match_keys: Optional[MatchKeys] = None,
+                      group_dims: Optional[Dict[str, int]] = None):
+        self.model_generator.create_tables(embedding_dim, match_keys, group_dims)
+
+    def close(self):
+        self.model_generator.close()
+
+class ShardedCaseStore:
+    """Routes writes by a hash of merchant_id and scatters reads across all shards
+
+    Reads run on every shard in parallel. Shards that fail or exceed the timeout
+    are left out of the merged result and listed in its failed_shards; a read
+    only raises if no shard answered. Writes raise on any failure. The executor
+    has a thread per pooled connection, so concurrent requests do not queue
+    behind one slow shard.
+    """
+
+    def __init__(self, shards: List[CaseShard], timeout_seconds: float = 5.0,
+                 connections_per_shard: int = 1):
+        if not shards:
+            raise ValueError("A sharded case store needs at least one shard")
+        self.shards = shards
+        self.timeout = timeout_seconds
+        self.executor = ThreadPoolExecutor(
+            max_workers=len(shards) * connections_per_shard, thread_name_prefix="case-shard"
+        )
+
+    @classmethod
+    def from_config(cls, db_config: DatabaseConfig) -> "ShardedCaseStore":
+        """Build one shard per entry in db_config.sharding, sharing the table and pool settings"""
+        shards = []
+        timeout_seconds = db_config.sharding.timeout_seconds
+        for shard_config in db_config.sharding.shards:
+            shard_db_config = db_config.model_copy(update={
+                'connection': db_config.connection.model_copy(update={'url': shard_config.url}),
+                'sharding': None
+            })
+            shards.append(CaseShard(
+                shard_config.name, DynamicModelGenerator(db_config=shard_db_config),
+                statement_timeout_ms=int(timeout_seconds * 1000)
+            ))
+        return cls(
+            shards,
+            timeout_seconds=timeout_seconds,
+            connections_per_shard=db_config.connection.pool_size + db_config.connection.max_overflow
+        )
+
+    def shard_for(self, merchant_id: str) -> CaseShard:
+        return self.shards[shard_index(merchant_id, len(self.shards))]
+
+    def _scatter(self, call: Callable[[CaseShard], Any]) -> Tuple[List[Any], List[str]]:
+        """Run call on every shard and return the successful results and the failed shard names"""
+        futures = {self.executor.submit(call, shard): shard for shard in self.shards}
+        done, not_done = wait(futures, timeout=self.timeout)
+
+        results, failed = [], []
+        for future in not_done:
+            # Reads already running are cancelled by their shard's statement timeout
+            future.cancel()
+            logger.warning(f"Shard {futures[future].name} timed out after {self.timeout}s")
+            failed.append(futures[future].name)
+        for future in done:
+            if future.exception() is not None:
+                logger.warning(f"Shard {futures[future].name} failed: {future.exception()}")
+                failed.append(futures[future].name)
+            else:
+                results.append(future.result())
+
+        if not results:
+            raise RuntimeError(f"All shards failed: {', '.join(sorted(failed))}")
+        return results, sorted(failed)
+
+    def find_similar_cases(self, embedding: np.ndarray, threshold: float = 0.3, limit: int = 5,
+                           case_filter: Optional[CaseFilter] = None, include_archive: bool = False) -> ShardedResults:
+        """Merge each shard's top-k into the global top-k"""
+        per_shard, failed = self._scatter(
+            lambda shard: shard.find_similar_cases(embedding, threshold, limit, case_filter, include_archive)
+        )
+        merged = heapq.nlargest(limit, chain.from_iterable(per_shard), key=lambda case: case[1])
+        return ShardedResults(merged, failed)
+
+    def find_similar_cases_by_group(self, group_embeddings: Dict[str, np.ndarray], weights: Dict[str, float],
+                                    threshold: float = 0.3, limit: int = 5,
+                                    case_filter: Optional[CaseFilter] = None) -> ShardedResults:
+        """Merge each shard's top-k by weighted per-group similarity into the global top-k"""
+        per_shard, failed = self._scatter(
+            lambda shard: shard.find_similar_cases_by_group(group_embeddings, weights, threshold, limit, case_filter)
+        )
+        merged = heapq.nlargest(limit, chain.from_iterable(per_shard), key=lambda case: case[1])
+        return ShardedResults(merged, failed)
+
+    def find_field_matches(self, field_name: str, value: Any,
+                           match_keys: Optional[MatchKeys] = None) -> ShardedResults:
+        """Get the merchant_ids on any shard with the same value, or match key, for a field"""
+        per_shard, failed = self._scatter(lambda shard: shard.find_field_matches(field_name, value, match_keys))
+        return ShardedResults(chain.from_iterable(per_shard), failed)
+
+    def get_case_generation(self) -> Optional[Tuple[int, ...]]:
+        """Get the write generation of every shard, or None if any shard did not answer"""
+        try:
+            per_shard, failed = self._scatter(lambda shard: (shard.name, shard.get_case_generation()))
+        except RuntimeError:
+            return None
+        if failed:
+            return None
+        return tuple(generation for _, generation in sorted(per_shard))
+
+    def store_many(self, entries: List[Dict[str, Any]]):
+        """Insert entries on their shards in parallel"""
+        by_shard = defaultdict(list)
+        for entry in entries:
+            by_shard[self.shard_for(entry['merchant_id']).name].append(entry)
+
+        shards = {shard.name: shard for shard in self.shards}
+        futures = [
+            self.executor.submit(shards[name].store_many, shard_entries)
+            for name, shard_entries in by_shard.items()
+        ]
+        for future in futures:
+            future.result()
+
+    def store(self, entry: Dict[str, Any]):
+        self.store_many([entry])
+
+    def create_tables(self, embedding_dim: int, match_keys: Optional[MatchKeys] = None,
+                      group_dims: Optional[Dict[str, int]] = None):
+        for shard in self.shards:
+            shard.create_tables(embedding_dim, match_keys, group_dims)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        for shard in self.shards:
+            shard.close()
@@ -0,0 +1,178 @@
+import json
+import os
+import shutil
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+import numpy as np
+from sqlalchemy import text
+from .dynamic_model import DynamicModelGenerator
+from .reembed import read_reembed_state
+
+MANIFEST_FILE = "manifest.json"
+
+class SnapshotExporter:
+    """Exports stored embeddings into memory-mappable .npy shards
+
+    Each run streams rows through a server-side cursor and writes them into
+    fixed-size shards under run-NNNNN/: shard-NNNNN.embeddings.npy (float32,
+    rows x embedding_dim) plus shard-NNNNN.ids.npy and shard-NNNNN.reasons.npy
+    mapping each row to its merchant_id and fraud_reason. The first run exports
+    the whole table; later runs only export rows whose updated_at is newer than
+    the watermark recorded in manifest.json, and readers let later runs supersede
+    earlier rows for the same merchant_id. Deleted rows are not tracked.
+
+    A re-embedding cutover replaces every vector without touching updated_at, so
+    the manifest records which migration the vectors come from; once another one
+    has completed, the next run exports the whole table again and replaces the
+    earlier runs.
+    """
+
+    def __init__(self, model_generator: DynamicModelGenerator, output_dir: Union[str, Path],
+                 shard_size: int = 100_000, lookback_seconds: float = 60.0):
+        self.model_generator = model_generator
+        self.output_dir = Path(output_dir)
+        self.shard_size = shard_size
+        # Re-read a little before the watermark so rows committed late with an earlier timestamp are not missed
+        self.lookback = timedelta(seconds=lookback_seconds)
+        self.table_name, self.table_config = next(iter(model_generator.db_config.tables.items()))
+
+    def _load_manifest(self) -> Dict:
+        manifest_path = self.output_dir / MANIFEST_FILE
+        if manifest_path.exists():
+            with open(manifest_path, 'r') as f:
+                return json.load(f)
+        return {
+            "table": f"{self.table_config.schema}.{self.table_name}",
+            "shard_size": self.shard_size,
+            "embedding_dim": None,
+            "embedding_version": None,
+            "watermark": None,
+            "next_run": 0,
+            "runs": []
+        }
+
+    def _embedding_version(self) -> Optional[str]:
+        """Get the completion time of the last re-embedding cutover of the table, if any"""
+        with self.model_generator.engine.connect() as conn:
+            state = read_reembed_state(conn, f"{self.table_config.schema}.{self.table_name}")
+        if state is None or state['completed_at'] is None:
+            return None
+        return state['completed_at'].isoformat()
+
+    def _write_manifest(self, manifest: Dict):
+        # Replace atomically so a failed run never advances the watermark
+        tmp_path = self.output_dir / f"{MANIFEST_FILE}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.output_dir / MANIFEST_FILE)
+
+    def _stream_rows(self, since: Optional[datetime]) -> Iterator[List[Tuple]]:
+        """Yield shard-sized partitions of rows from a server-side cursor"""
+        where = "embedding IS NOT NULL"
+        params = {}
+        if since is not None:
+            where += " AND updated_at > :since"
+            params['since'] = since - self.lookback
+
+        with self.model_generator.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=self.shard_size).execute(text(f"""
+                SELECT merchant_id, fraud_reason, embedding::real[] AS embedding, updated_at
+                FROM {self.table_config.schema}.{self.table_name}
+                WHERE {where}
+                ORDER BY updated_at, merchant_id
+            """), params)
+            for partition in result.partitions(self.shard_size):
+                yield partition
+
+    def export(self) -> Dict:
+        """Export everything changed since the last run and return the run's manifest entry"""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        manifest = self._load_manifest()
+        embedding_version = self._embedding_version()
+        superseded = []
+        if manifest["runs"] and manifest.get("embedding_version") != embedding_version:
+            # Every stored vector changed at the cutover: start over with a full export
+            superseded = [run["name"] for run in manifest["runs"]]
+            manifest.update({"embedding_dim": None, "watermark": None, "runs": []})
+        manifest["embedding_version"] = embedding_version
+        since = datetime.fromisoformat(manifest["watermark"]) if manifest["watermark"] else None
+
+        # Numbered past every earlier run, so a new run never reuses a directory still on disk
+        run_index = manifest.get("next_run", len(superseded) or len(manifest["runs"]))
+        manifest["next_run"] = run_index + 1
+        run_name = f"run-{run_index:05d}"
+        run_dir = self.output_dir / run_name
+        run_dir.mkdir(exist_ok=True)
+
+        shards = []
+        rows_exported = 0
+        watermark = since
+        for shard_index, rows in enumerate(self._stream_rows(since)):
+            shard_name = f"{run_name}/shard-{shard_index:05d}"
+            embeddings = np.asarray([row.embedding for row in rows], dtype=np.float32)
+            if manifest["embedding_dim"] is not None and embeddings.shape[1] != manifest["embedding_dim"]:
+                raise ValueError(
+                    f"{self.table_name} now stores {embeddings.shape[1]}-dimensional embeddings but the snapshot "
+                    f"in {self.output_dir} has {manifest['embedding_dim']}; export into a new directory"
+                )
+            np.save(self.output_dir / f"{shard_name}.embeddings.npy", embeddings)
+            np.save(self.output_dir / f"{shard_name}.ids.npy", np.asarray([row.merchant_id for row in rows]))
+            np.save(self.output_dir / f"{shard_name}.reasons.npy", np.asarray([row.fraud_reason or "" for row in rows]))
+
+            manifest["embedding_dim"] = int(embeddings.shape[1])
+            shards.append({"name": shard_name, "rows": len(rows)})
+            rows_exported += len(rows)
+            watermark = max(watermark, rows[-1].updated_at) if watermark else rows[-1].updated_at
+
+        run = {
+            "name": run_name,
+            "since": since.isoformat() if since else None,
+            "watermark": watermark.isoformat() if watermark else None,
+            "rows": rows_exported,
+            "shards": shards
+        }
+        manifest["runs"].append(run)
+        manifest["watermark"] = run["watermark"]
+        self._write_manifest(manifest)
+        for name in superseded:
+            shutil.rmtree(self.output_dir / name, ignore_errors=True)
+        return run
+
+class EmbeddingSnapshot:
+    """Read-only, memory-mapped view of a snapshot written by SnapshotExporter"""
+
+    def __init__(self, snapshot_dir: Union[str, Path]):
+        self.snapshot_dir = Path(snapshot_dir)
+        manifest_path = self.snapshot_dir / MANIFEST_FILE
+        if not manifest_path.exists():
+            raise FileNotFoundError(f"Snapshot manifest not found at {manifest_path}")
+        with open(manifest_path, 'r') as f:
+            self.manifest = json.load(f)
+        self.embedding_dim = self.manifest["embedding_dim"]
+
+    def shards(self) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """Yield (merchant_ids, fraud_reasons, embeddings) per shard, oldest run first"""
+        for run in self.manifest["runs"]:
+            for shard in run["shards"]:
+                base = self.snapshot_dir / shard["name"]
+                yield (
+                    np.load(f"{base}.ids.npy", mmap_mode='r'),
+                    np.load(f"{base}.reasons.npy", mmap_mode='r'),
+                    np.load(f"{base}.embeddings.npy", mmap_mode='r')
+                )
+
+    def latest(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Materialize the current version of every row, with later runs superseding earlier ones"""
+        positions: Dict[str, Tuple[int, int]] = {}
+        shards = list(self.shards())
+        for shard_index, (ids, _, _) in enumerate(shards):
+            for row_index, merchant_id in enumerate(ids):
+                positions[str(merchant_id)] = (shard_index, row_index)
+
+        merchant_ids = np.asarray(list(positions.keys()))
+        reasons = np.asarray([str(shards[s][1][r]) for s, r in positions.values()])
+        embeddings = np.empty((len(positions), self.embedding_dim or 0), dtype=np.float32)
+        for i, (s, r) in enumerate(positions.values()):
+            embeddings[i] = shards[s][2][r]
+        return merchant_ids, reasons, embeddings
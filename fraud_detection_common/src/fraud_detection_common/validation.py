@@ -0,0 +1,139 @@
+import math
+import re
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Mapping, Optional, Pattern
+from .config_schema import FieldConfig, ModelConfig
+
+if TYPE_CHECKING:
+    # Only training validates frames, so the API does not pay for importing pandas
+    import pandas as pd
+
+BOOLEAN_VALUES = {"true", "false", "1", "0", "yes", "no"}
+
+def _is_integer(value: Any) -> bool:
+    # Whole numbers written as floats ("1.0", or 1.0 from a column with gaps) count, as in the column check
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return True
+    try:
+        return float(str(value).strip()).is_integer()
+    except ValueError:
+        return False
+
+def _is_float(value: Any) -> bool:
+    if isinstance(value, bool):
+        return False
+    try:
+        # NaN is a missing number, which the column check cannot tell apart from a bad one
+        return not math.isnan(float(str(value).strip()))
+    except ValueError:
+        return False
+
+def _is_boolean(value: Any) -> bool:
+    return isinstance(value, bool) or str(value).strip().lower() in BOOLEAN_VALUES
+
+def _is_datetime(value: Any) -> bool:
+    if isinstance(value, datetime):
+        return True
+    try:
+        datetime.fromisoformat(str(value).strip())
+        return True
+    except ValueError:
+        return False
+
+# Per-value type checks; strings accept any scalar, since values are stored as their text
+TYPE_CHECKS: Dict[str, Callable[[Any], bool]] = {
+    "string": lambda value: not isinstance(value, (dict, list)),
+    "integer": _is_integer,
+    "float": _is_float,
+    "boolean": _is_boolean,
+    "datetime": _is_datetime
+}
+
+def _column_type_failures(column: "pd.Series", field_type: str) -> "pd.Series":
+    """Vectorized counterpart of TYPE_CHECKS, True where a present value has the wrong type"""
+    import pandas as pd
+    if field_type == "integer":
+        numbers = pd.to_numeric(column, errors="coerce")
+        return numbers.isna() | (numbers.abs() == float("inf")) | (numbers != numbers.round())
+    if field_type == "float":
+        return pd.to_numeric(column, errors="coerce").isna()
+    if field_type == "boolean":
+        return ~column.astype(str).str.strip().str.lower().isin(BOOLEAN_VALUES)
+    if field_type == "datetime":
+        return pd.to_datetime(column, errors="coerce", format="ISO8601").isna()
+    return pd.Series(False, index=column.index)
+
+class FieldRule:
+    """Checks of one field, compiled from its FieldConfig"""
+
+    def __init__(self, field: FieldConfig):
+        self.name = field.name
+        self.type = field.type
+        self.required = field.required
+        pattern = (field.validation_rules or {}).get("pattern")
+        self.pattern: Optional[Pattern] = re.compile(pattern) if pattern is not None else None
+
+    def check(self, value: Any) -> Optional[str]:
+        """Get the reason value is invalid, or None"""
+        if value is None or (isinstance(value, str) and not value.strip()):
+            return f"Missing {self.name}" if self.required else None
+        if not TYPE_CHECKS[self.type](value):
+            return f"Invalid {self.name}: expected {self.type}"
+        if self.pattern is not None and self.pattern.search(str(value)) is None:
+            return f"Invalid {self.name}: does not match {self.pattern.pattern}"
+        return None
+
+    def column_failures(self, column: "pd.Series") -> "pd.Series":
+        """Get a mask of the column's invalid values"""
+        text = column.astype(str)
+        missing = column.isna() | (text.str.strip() == "")
+        invalid = _column_type_failures(column, self.type)
+        if self.pattern is not None:
+            # The compiled pattern with its flags, on the same text check() searches
+            invalid |= ~text.str.contains(self.pattern, regex=True)
+        failures = invalid & ~missing
+        if self.required:
+            failures |= missing
+        return failures
+
+class RecordValidator:
+    """Validation of application records compiled once from the field configs
+
+    Applies each field's required flag, type and validation_rules pattern. validate
+    checks one record, for requests; validate_frame checks whole columns at once,
+    for batch and training ingest. Both run before any database work.
+    """
+
+    def __init__(self, fields: List[FieldConfig]):
+        self.rules = [FieldRule(field) for field in fields]
+
+    @classmethod
+    def from_model_config(cls, config: ModelConfig) -> "RecordValidator":
+        return cls(config.fields)
+
+    @classmethod
+    def from_field_types(cls, field_types: Mapping[str, str]) -> "RecordValidator":
+        """Validator requiring each field with its type, for tables without a model config"""
+        return cls([FieldConfig(name=name, type=field_type) for name, field_type in field_types.items()])
+
+    def validate(self, record: Mapping[str, Any]) -> List[str]:
+        """Get the reasons the record is invalid, empty if it is valid"""
+        errors = []
+        for rule in self.rules:
+            error = rule.check(record.get(rule.name))
+            if error is not None:
+                errors.append(error)
+        return errors
+
+    def validate_frame(self, data: "pd.DataFrame") -> "pd.DataFrame":
+        """Get a boolean frame with one column per field, True where a row's value is invalid"""
+        import pandas as pd
+        failures = {}
+        for rule in self.rules:
+            if rule.name in data.columns:
+                failures[rule.name] = rule.column_failures(data[rule.name])
+            else:
+                failures[rule.name] = pd.Series(rule.required, index=data.index)
+        return pd.DataFrame(failures, index=data.index)
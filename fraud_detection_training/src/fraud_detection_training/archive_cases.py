@@ -0,0 +1,57 @@
+import argparse
+import logging
+from pathlib import Path
+from typing import Optional
+from fraud_detection_common.dynamic_model import DynamicModelGenerator
+from fraud_detection_common.retention import archive_expired_cases
+from fraud_detection_common.sharding import ShardedCaseStore
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def archive_cases(model_generator: DynamicModelGenerator, case_store: Optional[ShardedCaseStore] = None,
+                  max_batches: Optional[int] = None) -> int:
+    """Move the cases past the retention policy into the archive, on every shard when sharded"""
+    generators = [model_generator]
+    if case_store is not None:
+        generators = [shard.model_generator for shard in case_store.shards]
+
+    total = 0
+    for generator in generators:
+        for table_name, table_config in generator.db_config.tables.items():
+            total += archive_expired_cases(
+                generator.engine, table_config.schema, table_name, generator.db_config.retention,
+                max_batches=max_batches
+            )
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="Move cases past the retention policy into the archive table")
+    parser.add_argument("--config", help="Path to database_config.json")
+    parser.add_argument("--max-batches", type=int, help="Stop after this many batches per table")
+    args = parser.parse_args()
+
+    config_path = args.config
+    if config_path is None:
+        # Same resolution as training: local config first, fall back to Docker config
+        project_root = Path(__file__).parent.parent.parent.parent
+        config_path = project_root / "config" / "database_config.local.json"
+        if not config_path.exists():
+            config_path = project_root / "config" / "database_config.json"
+
+    model_generator = DynamicModelGenerator(config_path)
+    case_store = None
+    try:
+        if model_generator.db_config.retention is None:
+            raise SystemExit("retention is not configured in the database config")
+        if model_generator.db_config.sharding is not None:
+            case_store = ShardedCaseStore.from_config(model_generator.db_config)
+        total = archive_cases(model_generator, case_store, args.max_batches)
+        logger.info(f"Archived {total} cases")
+    finally:
+        if case_store is not None:
+            case_store.close()
+        model_generator.close()
+
+if __name__ == "__main__":
+    main()
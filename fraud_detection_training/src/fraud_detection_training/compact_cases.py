@@ -0,0 +1,45 @@
+import argparse
+import logging
+from pathlib import Path
+from typing import Dict
+from fraud_detection_common.compaction import compact_cases
+from fraud_detection_common.dynamic_model import DynamicModelGenerator
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def compact(model_generator: DynamicModelGenerator, full: bool = False) -> Dict[str, int]:
+    """Cluster near-duplicate cases into centroids, only the cases stored since the last run unless full"""
+    totals = {'cases': 0, 'centroids': 0}
+    db_config = model_generator.db_config
+    for table_name, table_config in db_config.tables.items():
+        stats = compact_cases(model_generator.engine, table_config.schema, table_name, db_config.compaction, full=full)
+        totals['cases'] += stats['cases']
+        totals['centroids'] += stats['centroids']
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="Cluster near-duplicate stored cases behind indexed centroids")
+    parser.add_argument("--config", help="Path to database_config.json")
+    parser.add_argument("--full", action="store_true", help="Re-cluster every case instead of only the new ones")
+    args = parser.parse_args()
+
+    config_path = args.config
+    if config_path is None:
+        # Same resolution as training: local config first, fall back to Docker config
+        project_root = Path(__file__).parent.parent.parent.parent
+        config_path = project_root / "config" / "database_config.local.json"
+        if not config_path.exists():
+            config_path = project_root / "config" / "database_config.json"
+
+    model_generator = DynamicModelGenerator(config_path)
+    try:
+        if model_generator.db_config.compaction is None:
+            raise SystemExit("compaction is not configured in the database config")
+        totals = compact(model_generator, full=args.full)
+        logger.info(f"Compacted {totals['cases']} cases into {totals['centroids']} centroids")
+    finally:
+        model_generator.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import argparse
+import logging
+from pathlib import Path
+from fraud_detection_common.dynamic_model import DynamicModelGenerator
+from fraud_detection_common.snapshot import SnapshotExporter
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser(description="Export stored embeddings into memory-mappable .npy shards")
+    parser.add_argument("--output-dir", default="data/snapshot", help="Snapshot directory; reused for incremental runs")
+    parser.add_argument("--shard-size", type=int, default=100_000, help="Rows per shard")
+    parser.add_argument("--config", help="Path to database_config.json")
+    args = parser.parse_args()
+
+    config_path = args.config
+    if config_path is None:
+        # Same resolution as training: local config first, fall back to Docker config
+        project_root = Path(__file__).parent.parent.parent.parent
+        config_path = project_root / "config" / "database_config.local.json"
+        if not config_path.exists():
+            config_path = project_root / "config" / "database_config.json"
+
+    model_generator = DynamicModelGenerator(config_path)
+    try:
+        exporter = SnapshotExporter(model_generator, args.output_dir, shard_size=args.shard_size)
+        run = exporter.export()
+        logger.info(
+            f"Exported {run['rows']} rows in {len(run['shards'])} shards to {args.output_dir}/{run['name']} "
+            f"(watermark {run['watermark']})"
+        )
+    finally:
+        model_generator.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import argparse
+import logging
+from pathlib import Path
+from typing import Optional
+from fraud_detection_common.config import load_config
+from fraud_detection_common.dynamic_model import DynamicModelGenerator
+from fraud_detection_common.identity_links import IdentityLinkGraph
+from fraud_detection_common.match_keys import MatchKeys
+from fraud_detection_common.sharding import ShardedCaseStore
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def rebuild_identity_links(model_generator: DynamicModelGenerator, match_keys: MatchKeys,
+                           case_store: Optional[ShardedCaseStore] = None) -> dict:
+    """Recompute the identity-link graph from every stored case, reading all shards when sharded"""
+    graph = IdentityLinkGraph(model_generator, model_generator.db_config.identity_links, match_keys)
+    graph.create_tables()
+    engines = None
+    if case_store is not None:
+        engines = [shard.model_generator.engine for shard in case_store.shards]
+    return graph.rebuild(engines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the identity-link graph from the historical case table")
+    parser.add_argument("--config", help="Path to database_config.json")
+    parser.add_argument("--model-config", help="Path to model_config.json, for the fields' preprocessing")
+    args = parser.parse_args()
+
+    config_path = args.config
+    if config_path is None:
+        # Same resolution as training: local config first, fall back to Docker config
+        project_root = Path(__file__).parent.parent.parent.parent
+        config_path = project_root / "config" / "database_config.local.json"
+        if not config_path.exists():
+            config_path = project_root / "config" / "database_config.json"
+
+    model_generator = DynamicModelGenerator(config_path)
+    case_store = None
+    try:
+        if model_generator.db_config.identity_links is None:
+            raise SystemExit("identity_links is not configured in the database config")
+        if model_generator.db_config.sharding is not None:
+            case_store = ShardedCaseStore.from_config(model_generator.db_config)
+        match_keys = MatchKeys.from_model_config(load_config(args.model_config))
+        stats = rebuild_identity_links(model_generator, match_keys, case_store)
+        logger.info(
+            f"Linked {stats['merchants']} merchants through {stats['links']} identifiers "
+            f"into {stats['clusters']} clusters"
+        )
+    finally:
+        if case_store is not None:
+            case_store.close()
+        model_generator.close()
+
+if __name__ == "__main__":
+    main()
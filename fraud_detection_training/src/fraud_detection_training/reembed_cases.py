@@ -0,0 +1,61 @@
+import argparse
+import logging
+import shutil
+from pathlib import Path
+from fraud_detection_common.dynamic_model import DynamicModelGenerator
+from fraud_detection_common.model_artifact import ModelArtifact
+from fraud_detection_common.reembed import ReembedMigration
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Re-embed the stored cases with a new model artifact while the API keeps serving"
+    )
+    parser.add_argument("--artifact", help="Model artifact to migrate to; must be readable by the API at this path")
+    parser.add_argument("--install-to", help="Copy the artifact here after the cutover, e.g. config/embedding_model.pkl")
+    parser.add_argument("--batch-size", type=int, default=500, help="Rows embedded per transaction")
+    parser.add_argument("--batch-pause-ms", type=float, default=100.0, help="Pause between batches")
+    parser.add_argument("--no-cutover", action="store_true", help="Only backfill; run again to resume and cut over")
+    parser.add_argument("--status", action="store_true", help="Print the progress of the migration and exit")
+    parser.add_argument("--config", help="Path to database_config.json")
+    args = parser.parse_args()
+
+    config_path = args.config
+    if config_path is None:
+        # Same resolution as training: local config first, fall back to Docker config
+        project_root = Path(__file__).parent.parent.parent.parent
+        config_path = project_root / "config" / "database_config.local.json"
+        if not config_path.exists():
+            config_path = project_root / "config" / "database_config.json"
+
+    model_generator = DynamicModelGenerator(config_path)
+    try:
+        migration = ReembedMigration(
+            model_generator, batch_size=args.batch_size, batch_pause_ms=args.batch_pause_ms
+        )
+        if args.status:
+            logger.info(f"Re-embedding migration: {migration.state()}")
+            return
+        if args.artifact is None:
+            raise SystemExit("--artifact is required unless --status is given")
+
+        artifact_path = str(Path(args.artifact).resolve())
+        artifact = ModelArtifact.load(artifact_path)
+        migration.start(artifact_path, artifact.embedding_dim)
+        migration.backfill(artifact.generator)
+        if args.no_cutover:
+            return
+
+        migration.build_indexes()
+        migration.cutover(artifact.generator)
+        if args.install_to:
+            # API workers started from now on load the new artifact directly
+            shutil.copyfile(artifact_path, args.install_to)
+            logger.info(f"Installed {artifact_path} as {args.install_to}")
+    finally:
+        model_generator.close()
+
+if __name__ == "__main__":
+    main()
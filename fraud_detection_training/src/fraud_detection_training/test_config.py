@@ -15,7 +15,7 @@ def main():
             print(f"Schema: {table_config.schema}")
             print("Indexes:")
             for index in table_config.indexes:
-                print(f"  - {index.name} ({index.type}) on {index.column}")
+                print(f"  - {index.name} ({index.type}) on {', '.join(index.columns or [index.column])}")
     except Exception as e:
         print(f"Error loading configuration: {e}")
 
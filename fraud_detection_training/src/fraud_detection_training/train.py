@@ -1,11 +1,21 @@
 import json
 from pathlib import Path
+from typing import Dict, List, Optional
 from tqdm import tqdm
 from collections import defaultdict
 from fraud_detection_common.database import Database
 from fraud_detection_common.embeddings import EmbeddingGenerator
 from fraud_detection_common.config import load_config
+from fraud_detection_common.config_schema import ModelConfig
 from fraud_detection_common.dynamic_model import DynamicModelGenerator
+from fraud_detection_common.model_artifact import ModelArtifact
+from fraud_detection_common.match_keys import MatchKeys
+from fraud_detection_common.validation import RecordValidator
+from fraud_detection_common.database_config import GroupVectorConfig
+from fraud_detection_common.group_vectors import group_column
+from fraud_detection_common.sharding import ShardedCaseStore
+from fraud_detection_training.rebuild_identity_links import rebuild_identity_links
+from fraud_detection_training.compact_cases import compact
 import pandas as pd
 import logging
 
@@ -21,15 +31,54 @@ def load_training_data(data_path: Path):
     else:
         raise ValueError(f"Unsupported file format: {data_path.suffix}")
 
-def process_training_data(data: pd.DataFrame, model_generator: DynamicModelGenerator):
+def filter_valid_rows(data: pd.DataFrame, model_config: ModelConfig) -> pd.DataFrame:
+    """Drop the rows failing the configured field validation, checked a column at a time"""
+    failures = RecordValidator.from_model_config(model_config).validate_frame(data)
+    invalid = failures.any(axis=1)
+    if invalid.any():
+        counts = {field: int(count) for field, count in failures.sum().items() if count}
+        logger.warning(f"Skipping {int(invalid.sum())} of {len(data)} rows failing validation: {counts}")
+    return data[~invalid].reset_index(drop=True)
+
+def embedding_records(data: pd.DataFrame, embedding_generator: EmbeddingGenerator):
+    """Get the configured embedding fields of the training data as string records"""
+    field_names = [field["name"] for field in embedding_generator.config["fields"]]
+    return data[field_names].fillna('').astype(str).to_dict('records')
+
+def fit_embedding_generator(data: pd.DataFrame, model_config: ModelConfig) -> EmbeddingGenerator:
+    """Fit an embedding generator on the training data"""
+    embedding_generator = EmbeddingGenerator(model_config.model_dump())
+    embedding_generator.fit(embedding_records(data, embedding_generator))
+    logger.info(f"Fitted embedding generator with output dimension {embedding_generator.output_dim}")
+    return embedding_generator
+
+def group_vector_entries(data: pd.DataFrame, embedding_generator: EmbeddingGenerator,
+                         group_vectors: Optional[GroupVectorConfig]) -> List[Dict[str, list]]:
+    """Get each row's per-group vector columns, empty when the table has no per-group layout"""
+    if group_vectors is None:
+        return [{} for _ in range(len(data))]
+    vectors = embedding_generator.transform_groups_batch(embedding_records(data, embedding_generator))
+    return [
+        {group_column(group): vectors[group][position].tolist() for group in group_vectors.groups}
+        for position in range(len(data))
+    ]
+
+def process_training_data(data: pd.DataFrame, model_generator: DynamicModelGenerator,
+                          embedding_generator: EmbeddingGenerator, match_keys: Optional[MatchKeys] = None):
     """Process training data and store in database"""
     session = model_generator.get_session()
     try:
-        # Create tables if they don't exist
-        model_generator.create_tables()
+        # Create tables sized to the fitted generator's output dimensions, with the match-key columns
+        model_generator.create_tables(
+            embedding_generator.output_dim, match_keys, embedding_generator.group_output_dims
+        )
+        
+        # Embed all rows in one pass
+        embeddings = embedding_generator.transform_batch(embedding_records(data, embedding_generator))
+        group_entries = group_vector_entries(data, embedding_generator, model_generator.db_config.group_vectors)
         
         # Process each row
-        for _, row in data.iterrows():
+        for position, (_, row) in enumerate(data.iterrows()):
             # Convert row to dict
             application_data = row.to_dict()
             
@@ -57,6 +106,8 @@ def process_training_data(data: pd.DataFrame, model_generator: DynamicModelGener
                 entry = table(
                     merchant_id=merchant_id,
                     fraud_reason=fraud_reason,
+                    embedding=embeddings[position].tolist(),
+                    **group_entries[position],
                     **filtered_data
                 )
                 session.add(entry)
@@ -68,6 +119,37 @@ def process_training_data(data: pd.DataFrame, model_generator: DynamicModelGener
     finally:
         session.close()
 
+def process_sharded_training_data(data: pd.DataFrame, case_store: ShardedCaseStore,
+                                  embedding_generator: EmbeddingGenerator, batch_size: int = 1000,
+                                  match_keys: Optional[MatchKeys] = None):
+    """Process training data and store it across the configured shards"""
+    # Create tables on every shard sized to the fitted generator's output dimension
+    case_store.create_tables(embedding_generator.output_dim, match_keys, embedding_generator.group_output_dims)
+    
+    embeddings = embedding_generator.transform_batch(embedding_records(data, embedding_generator))
+    group_entries = group_vector_entries(
+        data, embedding_generator, case_store.shards[0].model_generator.db_config.group_vectors
+    )
+    valid_fields = {field['name'] for field in case_store.shards[0].table_config.fields}
+    
+    entries = []
+    for position, application_data in enumerate(data.astype(object).where(data.notna(), None).to_dict('records')):
+        merchant_id = application_data.pop('merchant_id', None)
+        if not merchant_id:
+            print(f"Skipping row without merchant_id: {application_data}")
+            continue
+        entries.append({
+            'merchant_id': merchant_id,
+            'fraud_reason': application_data.pop('fraud_reason', None),
+            'embedding': embeddings[position].tolist(),
+            **group_entries[position],
+            **{k: v for k, v in application_data.items() if k in valid_fields}
+        })
+    
+    # Rows are routed to their shard by a hash of merchant_id
+    for start in range(0, len(entries), batch_size):
+        case_store.store_many(entries[start:start + batch_size])
+
 def main():
     # Get config path relative to the project root
     project_root = Path(__file__).parent.parent.parent.parent
@@ -83,10 +165,29 @@ def main():
     try:
         # Load training data
         data_path = project_root / "fraud_detection_training" / "data" / "training_data.csv"
-        data = load_training_data(data_path)
+        model_config = load_config(project_root / "config" / "model_config.json")
+        data = filter_valid_rows(load_training_data(data_path), model_config)
+        
+        # Fit the embedding generator and record its output dimension in the model artifact
+        embedding_generator = fit_embedding_generator(data, model_config)
+        ModelArtifact(embedding_generator).save(project_root / "config" / "embedding_model.pkl")
+        match_keys = MatchKeys.from_model_config(model_config)
         
         # Process training data
-        process_training_data(data, model_generator)
+        if model_generator.db_config.sharding is not None:
+            case_store = ShardedCaseStore.from_config(model_generator.db_config)
+            try:
+                process_sharded_training_data(data, case_store, embedding_generator, match_keys=match_keys)
+                if model_generator.db_config.identity_links is not None:
+                    rebuild_identity_links(model_generator, match_keys, case_store)
+            finally:
+                case_store.close()
+        else:
+            process_training_data(data, model_generator, embedding_generator, match_keys)
+            if model_generator.db_config.identity_links is not None:
+                rebuild_identity_links(model_generator, match_keys)
+            if model_generator.db_config.compaction is not None:
+                compact(model_generator)
         
     finally:
         model_generator.close()